@@ -24,9 +24,16 @@ import signal
 import sys
 from telethon import TelegramClient
 import json
-from datetime import datetime
 from config import Config  # Import the API id, hash from here
 import asyncio
+from contextlib import aclosing
+from rate_limiter import AdaptiveRateLimiter
+from concurrent_crawl import crawl_channels
+import metrics
+from entity_cache import EntityCache, FileEntityStore
+from jsonl_sink import JsonlSink
+from message_stream import stream_pages, peak_rss_mb
+from serializer import serialize, dumps
 
 # Get credentials from the Config.py file
 api_id = Config['api_id']
@@ -34,10 +41,31 @@ api_hash = Config['api_hash']
 session_name = Config['username']
 monitoring_channels = ["pal_Online9"]
 
-# Telegram API rate limit: 30 requests per second
+# Telegram API rate limit: at most 30 history requests per second
 RATE_LIMIT = 30  # requests per second
-DELAY = 1 / RATE_LIMIT  # Delay between requests in seconds
+ENTITY_RATE_LIMIT = 1  # get_entity resolves usernames, which Telegram limits much more tightly
 MESSAGES_PER_REQUEST = 100  # Maximum messages per request
+PREFETCH_PAGES = 1  # Pages fetched ahead of the one being saved
+CONCURRENCY = 8  # Maximum number of channels crawled at the same time
+METRICS_PORT = metrics.port_from_env()  # Prometheus /metrics port from $METRICS_PORT; off when unset
+METRICS_LOG_EVERY = 60  # Seconds between structured metric summaries in the log
+
+# One limiter shared by all channels keeps the whole crawl within its budgets,
+# slowing down and waiting out the server-specified time on FloodWaitError
+rate_limiter = AdaptiveRateLimiter({"history": RATE_LIMIT, "get_entity": ENTITY_RATE_LIMIT})
+
+# Username -> peer id and access hash, so warm starts make no get_entity calls
+ENTITY_CACHE_FILE = "entity_cache.json"
+entity_cache = EntityCache(FileEntityStore(ENTITY_CACHE_FILE), session_name)
+
+# Output files: one open JSONL file per channel, rotated by size or message count
+OUTPUT_DIR = "."
+MAX_FILE_BYTES = 256 * 1024 * 1024  # Rotate after this many (uncompressed) bytes
+MAX_FILE_MESSAGES = None  # Or after this many messages
+COMPRESSION = None  # None, "gzip" or "zstd"
+FSYNC_EVERY_PAGES = 10  # Flush to disk every N pages per channel
+SERIALIZE_MODE = "lean"  # "lean" projected schema or "full" Telethon to_dict output
+sink = JsonlSink(OUTPUT_DIR, max_bytes=MAX_FILE_BYTES, max_messages=MAX_FILE_MESSAGES, compression=COMPRESSION)
 
 # Global flag to handle graceful shutdown
 stop_signal = False
@@ -53,50 +81,41 @@ signal.signal(signal.SIGINT, handle_stop_signal)
 
 async def fetch_messages(client, chat_name, limit=None):
     """Fetch all messages from a given chat with rate limiting, pagination, and progress."""
-    chat_info = await client.get_entity(chat_name)
-    all_messages = []
-    offset_id = 0
-
-    while True:
-        if stop_signal:
-            break  # Exit if the stop signal is received
-
-        # Fetch messages
-        messages = await client.get_messages(entity=chat_info, limit=MESSAGES_PER_REQUEST, offset_id=offset_id)
-        if not messages:
-            break  # Stop when no more messages are returned
-
-        all_messages.extend(messages)
-        offset_id = messages[-1].id  # Use the last message ID to paginate
-
-        # Print progress
-        print(f"Fetched {len(all_messages)} messages so far...")
-
-        # Sleep to avoid hitting the rate limit
-        await asyncio.sleep(DELAY)
-
-        # Exit if limit is reached
-        if limit and len(all_messages) >= limit:
-            break
-
-        # Save messages incrementally
-        save_messages(all_messages, chat_name)
-
-    return {"messages": all_messages, "channel": chat_info}
+    try:
+        # Cached username -> peer lookup; the entry is dropped if Telegram rejects the peer
+        async with entity_cache.peer(client, chat_name, rate_limiter) as chat_info:
+            count = 0  # Pages are saved as they arrive, so only the current one is kept in memory
+            pages_saved = 0
+
+            # Pages arrive as they are fetched; fetching pauses while the consumer is behind
+            pages = stream_pages(client, chat_info, rate_limiter, MESSAGES_PER_REQUEST,
+                                 prefetch=PREFETCH_PAGES, should_stop=lambda: stop_signal)
+            async with aclosing(pages):
+                async for messages in pages:
+                    count += len(messages)
+
+                    # Print progress
+                    print(f"[{chat_name}] Fetched {count} messages so far...")
+
+                    # Save only the new page incrementally
+                    save_messages(messages, chat_name)
+                    pages_saved += 1
+                    if pages_saved % FSYNC_EVERY_PAGES == 0:
+                        sink.checkpoint(chat_name)
+
+                    # Exit if limit is reached
+                    if limit and count >= limit:
+                        break
+    finally:
+        # Fsync and close the channel's file, also on a graceful shutdown or a failed fetch
+        sink.close(chat_name)
+    return {"count": count, "channel": chat_info}
 
 def save_messages(messages, chat_name):
-    """Save the fetched messages to a file."""
-    filename = get_filename(chat_name)
-    with open(filename, 'a') as f:
-        for msg in messages:
-            f.write(f'{serialize_message(msg)}\n')
-
-def get_date():
-    current_date_time = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
-    return current_date_time
-
-def get_filename(chat_name):
-    return f'{chat_name}__{get_date()}.txt'
+    """Append one page of fetched messages to the channel's file."""
+    with metrics.SERIALIZE_SECONDS.time():
+        lines = [serialize_message(msg) for msg in messages]
+    sink.write(chat_name, lines)
 
 
 '''
@@ -113,30 +132,23 @@ def serialize_message(message):
 '''
 
 def serialize_message(message):
-    """Serialize the message, convert dates, and exclude media."""
-    msg_dict = message.to_dict()
-    
-    # Convert 'date' and 'edit_date' to string formats if they exist
-    if isinstance(msg_dict.get('date'), datetime):
-        msg_dict['date'] = msg_dict['date'].strftime("%Y_%m_%d_%H_%M_%S")
-    
-    if isinstance(msg_dict.get('edit_date'), datetime):
-        msg_dict['edit_date'] = msg_dict['edit_date'].strftime("%Y_%m_%d_%H_%M_%S")
-    
-    # Exclude 'media' field if present
-    if 'media' in msg_dict:
-        del msg_dict['media']  # Exclude media to keep it simple
-    
+    """Serialize the message in the configured schema; dates keep the %Y_%m_%d_%H_%M_%S format."""
     # Return the JSON representation of the message
-    return json.dumps(msg_dict)
+    return dumps(serialize(message, SERIALIZE_MODE))
 
 
 # Main function
 async def main():
-    async with TelegramClient(session_name, api_id, api_hash) as client:
-        for chat_name in monitoring_channels:
-            print(f'Start fetching messages from: {chat_name}')
-            await fetch_messages(client, chat_name)
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT)
+    summaries = asyncio.create_task(metrics.log_summary(METRICS_LOG_EVERY))
+    # flood_sleep_threshold=0 hands every FloodWaitError to the rate limiter instead of sleeping inside Telethon
+    async with TelegramClient(session_name, api_id, api_hash, flood_sleep_threshold=0) as client:
+        await crawl_channels(client, monitoring_channels, fetch_messages, concurrency=CONCURRENCY)
+    summaries.cancel()
+    print(rate_limiter.report())
+    print(entity_cache.report())
+    print(f"Peak RSS: {peak_rss_mb():.1f} MB")
 
 # Run the main function
 asyncio.run(main())
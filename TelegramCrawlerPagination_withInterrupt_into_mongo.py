@@ -6,6 +6,23 @@ from datetime import datetime
 from pymongo import MongoClient  # MongoDB integration
 from config import Config  # Import the API id, hash from here
 import asyncio
+from contextlib import aclosing
+from functools import partial
+from rate_limiter import AdaptiveRateLimiter
+from concurrent_crawl import crawl_channels
+import metrics
+from entity_cache import EntityCache, MongoEntityStore
+from media_pipeline import MediaPipeline
+from checkpoints import CheckpointStore, iter_checkpointed_pages
+from message_stream import peak_rss_mb
+from serializer import serialize
+from message_queries import print_messages_for_date
+from mongo_writer import BulkMessageWriter
+from async_writer import ThreadedMessageWriter
+from mongo_schema import ensure_indexes
+from rollups import ActivityRollups
+from search import SearchIndex
+from pymongo.write_concern import WriteConcern
 from pymongo import MongoClient
 from datetime import datetime
 
@@ -13,6 +30,24 @@ from datetime import datetime
 client = MongoClient('localhost', 27017)
 db = client['Telegram']  # Database name
 collection = db['messages']  # Collection name
+ensure_indexes(db)  # Unique (channel_id, id) upsert key plus the date indexes readers need
+checkpoints = CheckpointStore(db['checkpoints'])  # Newest/oldest message id ingested per channel
+
+# Batched writes: one unordered bulk_write per WRITE_BATCH_PAGES pages, on a writer thread
+# so fetching carries on while a batch is written; at most WRITE_QUEUE_PAGES pages wait for it
+WRITE_BATCH_PAGES = 1
+WRITE_QUEUE_PAGES = 8
+WRITE_CONCERN = WriteConcern(w=1)
+writer = ThreadedMessageWriter(BulkMessageWriter(collection, batch_pages=WRITE_BATCH_PAGES,
+                                                 write_concern=WRITE_CONCERN), max_pages=WRITE_QUEUE_PAGES)
+
+# Per-channel daily/hourly activity, updated with every newly inserted message
+rollups = ActivityRollups(db['activity_rollups'])
+writer.on_insert(rollups.record)
+
+# Full-text search sidecar (search.py), fed every written batch so edited text is re-indexed
+search_index = SearchIndex("search.sqlite3")
+writer.on_write(search_index.record)
 
 # Get credentials from the Config.py file
 api_id = Config['api_id']
@@ -20,10 +55,29 @@ api_hash = Config['api_hash']
 session_name = Config['username']
 monitoring_channels = ["pal_Online9"]
 
-# Telegram API rate limit: 30 requests per second
+# Telegram API rate limit: at most 30 history requests per second
 RATE_LIMIT = 30  # requests per second
-DELAY = 1 / RATE_LIMIT  # Delay between requests in seconds
+ENTITY_RATE_LIMIT = 1  # get_entity resolves usernames, which Telegram limits much more tightly
 MESSAGES_PER_REQUEST = 100  # Maximum messages per request
+PREFETCH_PAGES = 1  # Pages fetched ahead of the one being saved
+SERIALIZE_MODE = "lean"  # "lean" projected schema or "full" Telethon to_dict output
+CONCURRENCY = 8  # Maximum number of channels crawled at the same time
+METRICS_PORT = metrics.port_from_env()  # Prometheus /metrics port from $METRICS_PORT; off when unset
+METRICS_LOG_EVERY = 60  # Seconds between structured metric summaries in the log
+
+# Optional media stage: set MEDIA_DIR to download photos and documents next to the crawl
+MEDIA_DIR = None
+MEDIA_WORKERS = 4  # Concurrent downloads
+MEDIA_RATE_LIMIT = 5  # Media downloads started per second
+media = None
+
+# One limiter shared by all channels keeps the whole crawl within its budgets,
+# slowing down and waiting out the server-specified time on FloodWaitError
+rate_limiter = AdaptiveRateLimiter({"history": RATE_LIMIT, "get_entity": ENTITY_RATE_LIMIT,
+                                    "media": MEDIA_RATE_LIMIT})
+
+# Username -> peer id and access hash, so warm starts make no get_entity calls
+entity_cache = EntityCache(MongoEntityStore(db['entities']), session_name)
 
 # Global flag to handle graceful shutdown
 stop_signal = False
@@ -38,37 +92,32 @@ def handle_stop_signal(signum, frame):
 signal.signal(signal.SIGINT, handle_stop_signal)
 
 async def fetch_messages(client, chat_name, limit=None):
-    """Fetch all messages from a given chat with rate limiting, pagination, and progress."""
-    chat_info = await client.get_entity(chat_name)
-    all_messages = []
-    offset_id = 0
-
-    while True:
-        if stop_signal:
-            break  # Exit if the stop signal is received
-
-        # Fetch messages
-        messages = await client.get_messages(entity=chat_info, limit=MESSAGES_PER_REQUEST, offset_id=offset_id)
-        if not messages:
-            break  # Stop when no more messages are returned
-
-        all_messages.extend(messages)
-        offset_id = messages[-1].id  # Use the last message ID to paginate
-
-        # Print progress
-        print(f"Fetched {len(all_messages)} messages so far...")
-
-        # Save messages incrementally to MongoDB
-        save_messages_to_mongo(messages, chat_name)
-
-        # Sleep to avoid hitting the rate limit
-        await asyncio.sleep(DELAY)
-
-        # Exit if limit is reached
-        if limit and len(all_messages) >= limit:
-            break
-
-    return {"messages": all_messages, "channel": chat_info}
+    """Fetch the messages of a chat not yet in MongoDB, resuming from its checkpoint."""
+    # Cached username -> peer lookup; the entry is dropped if Telegram rejects the peer
+    async with entity_cache.peer(client, chat_name, rate_limiter) as chat_info:
+        count = 0  # Pages are saved as they arrive, so only the current one is kept in memory
+
+        # New messages first (min_id), then whatever is left of the backfill (offset_id)
+        pages = iter_checkpointed_pages(client, chat_info, chat_name, checkpoints, rate_limiter,
+                                        MESSAGES_PER_REQUEST, should_stop=lambda: stop_signal,
+                                        on_durable=writer.after_flush, prefetch=PREFETCH_PAGES)
+        async with aclosing(pages):
+            async for messages in pages:
+                count += len(messages)
+
+                # Print progress
+                print(f"[{chat_name}] Fetched {count} messages so far...")
+
+                # Save messages incrementally to MongoDB
+                await save_messages_to_mongo(messages, chat_name)
+
+                # Exit if limit is reached
+                if limit and count >= limit:
+                    break
+
+    # Write whatever is left of the last batch
+    await writer.flush()
+    return {"count": count, "channel": chat_info}
 '''
 def save_messages_to_mongo(messages, chat_name):
     """Insert messages into MongoDB."""
@@ -91,65 +140,54 @@ def save_messages_to_mongo(messages, chat_name):
     print(f"Saved {len(messages)} messages to MongoDB, avoiding duplicates.")
 '''
 
-def save_messages_to_mongo(messages, chat_name):
-    """Insert messages into MongoDB, avoiding duplicates."""
-    for message in messages:
-        serialized_message = serialize_message(message)
-
-        # Use message ID to check for duplicates
-        collection.update_one(
-            {"id": serialized_message["id"]},  # Check for existing message with the same 'id'
-            {"$set": serialized_message},      # Insert or update the message
-            upsert=True                        # Ensure no duplicates
-        )
-    print(f"Saved {len(messages)} messages to MongoDB, avoiding duplicates.")
-
-def print_messages_for_date(target_date):
-    # Connect to MongoDB
-    client = MongoClient('localhost', 27017)
-    db = client['Telegram']  # Database name
-    collection = db['messages']  # Collection name
-
-    # Convert the target date to a datetime object (start and end of the day)
-    start_of_day = datetime.combine(target_date, datetime.min.time())
-    end_of_day = datetime.combine(target_date, datetime.max.time())
-
-    # Query to find messages within the date range
-    query = {
-        'date': {'$gte': start_of_day, '$lt': end_of_day}
-    }
-
-    # Retrieve and print the messages
-    messages = collection.find(query)
-    for message in messages:
-        print(f"User: {message.get('from_id')}, Message: {message.get('text')}, Date: {message.get('date')}")
-    
+async def save_messages_to_mongo(messages, chat_name):
+    """Upsert messages into MongoDB as one unordered bulk write, avoiding duplicates."""
+    with metrics.SERIALIZE_SECONDS.time():
+        documents = [serialize_message(message) for message in messages]
+    await writer.add(documents)  # Only waits while the writer thread is WRITE_QUEUE_PAGES pages behind
+    if media:
+        # Queued once the messages are written, so the media can be linked to their documents;
+        # the media queue belongs to the event loop, so the writer thread hands the call back to it
+        loop = asyncio.get_running_loop()
+        writer.after_flush(partial(loop.call_soon_threadsafe, media.submit_all, messages))
 
 def serialize_message(message):
-    """Serialize the message, convert dates, and exclude media."""
-    msg_dict = message.to_dict()
-
-    # Convert 'date' and 'edit_date' to string formats if they exist
-    if isinstance(msg_dict.get('date'), datetime):
-        msg_dict['date'] = msg_dict['date'].strftime("%Y_%m_%d_%H_%M_%S")
-    if isinstance(msg_dict.get('edit_date'), datetime):
-        msg_dict['edit_date'] = msg_dict['edit_date'].strftime("%Y_%m_%d_%H_%M_%S")
-
-    # Exclude 'media' field if present
-    if 'media' in msg_dict:
-        del msg_dict['media']  # Exclude media to keep it simple
+    """Serialize the message in the configured schema, keeping dates as native datetimes."""
+    # 'date' and 'edit_date' stay datetimes so MongoDB stores them as indexed BSON dates
+    msg_dict = serialize(message, SERIALIZE_MODE)
 
     return msg_dict  # MongoDB can directly handle dictionaries
 
 # Main function
 async def main():
-    async with TelegramClient(session_name, api_id, api_hash) as client:
-        for chat_name in monitoring_channels:
-            print(f'Start fetching messages from: {chat_name}')
-            await fetch_messages(client, chat_name)
+    global media
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT)
+    summaries = asyncio.create_task(metrics.log_summary(METRICS_LOG_EVERY))
+    writer.start()
+    try:
+        # flood_sleep_threshold=0 hands every FloodWaitError to the rate limiter instead of sleeping inside Telethon
+        async with TelegramClient(session_name, api_id, api_hash, flood_sleep_threshold=0) as client:
+            if MEDIA_DIR:
+                media = MediaPipeline(db['media'], collection, MEDIA_DIR, workers=MEDIA_WORKERS,
+                                      rate_limiter=rate_limiter)
+                media.start()
+            await crawl_channels(client, monitoring_channels, fetch_messages, concurrency=CONCURRENCY)
+            if media:
+                await media.close()  # Let the downloads still queued finish
+    finally:
+        # Even when the crawl fails, the pages still queued for the writer thread get written
+        await writer.close()
+    summaries.cancel()
+    print(rate_limiter.report())
+    print(entity_cache.report())
+    print(writer.report())
+    if media:
+        print(media.report())
+    print(f"Peak RSS: {peak_rss_mb():.1f} MB")
 
     # Example usage: Print messages for September 29, 2024
-    print_messages_for_date(datetime(2024, 9, 27))
+    print_messages_for_date(collection, datetime(2024, 9, 27))
 
 
 # Run the main function
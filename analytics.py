@@ -0,0 +1,222 @@
+import sys
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from pymongo import MongoClient
+from mongo_schema import peer_dict_to_id
+
+# Columns the analytics need, and the pandas dtype each is held in (nullable where Telegram leaves it out)
+FIELDS = {
+    "id": "int64",
+    "channel_id": "int64",
+    "date": "datetime64[ns, UTC]",
+    "from_id": "Int64",
+    "views": "Int64",
+    "forwards": "Int64",
+    "reply_to_msg_id": "Int64",
+    "fwd_from_id": "Int64",
+}
+# Where the full to_dict schema (and documents from before the lean schema) keeps the same values
+NESTED_FIELDS = ("reply_to.reply_to_msg_id", "fwd_from.from_id")
+CHUNK_ROWS = 200000  # Documents turned into arrays at a time while loading from Mongo
+CACHE_ENTRIES = 8  # Loaded (channel, start, end) ranges kept in memory
+
+
+def lean_fields(document):
+    """`document` with the FIELDS of the full schema moved to their lean names and peer dicts made ids."""
+    reply_to = document.pop("reply_to", None)
+    if isinstance(reply_to, dict):
+        document["reply_to_msg_id"] = reply_to.get("reply_to_msg_id")
+    fwd_from = document.pop("fwd_from", None)
+    if isinstance(fwd_from, dict):
+        document["fwd_from_id"] = fwd_from.get("from_id")
+    for name in ("from_id", "fwd_from_id"):
+        if isinstance(document.get(name), dict):
+            document[name] = peer_dict_to_id(document[name])
+    return document
+
+
+def _frame(records):
+    frame = pd.DataFrame.from_records(records, columns=list(FIELDS))
+    frame["date"] = pd.to_datetime(frame["date"], utc=True)
+    return frame.astype(FIELDS)
+
+
+def date_match(channel_id=None, start=None, end=None):
+    match = {"date": {"$type": "date"}, "deleted": {"$ne": True}}  # Same rows as the Parquet export
+    if start:
+        match["date"]["$gte"] = start
+    if end:
+        match["date"]["$lt"] = end
+    if channel_id is not None:
+        match["channel_id"] = channel_id
+    return match
+
+
+def load_from_mongo(collection, channel_id=None, start=None, end=None, chunk_rows=CHUNK_ROWS):
+    """Messages of one channel (or all) with start <= date < end as a DataFrame of FIELDS.
+
+    Only the needed fields leave Mongo, and they are converted to arrays a chunk at a
+    time, so the Python objects of at most `chunk_rows` documents exist at once.
+    Documents of the full schema are read too (see lean_fields).
+    """
+    projection = {"_id": 0, **{name: 1 for name in FIELDS}, **{path: 1 for path in NESTED_FIELDS}}
+    cursor = collection.find(date_match(channel_id, start, end), projection).batch_size(10000)
+    chunks = []
+    records = []
+    for document in cursor:
+        records.append(lean_fields(document))
+        if len(records) >= chunk_rows:
+            chunks.append(_frame(records))
+            records = []
+    chunks.append(_frame(records))
+    return pd.concat(chunks, ignore_index=True)
+
+
+def load_from_parquet(directory, channel_id=None, start=None, end=None):
+    """The same frame read from a parquet_export.py directory; only matching partitions are opened."""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    keys = ds.partitioning(pa.schema([("channel", pa.int64()), ("day", pa.string())]), flavor="hive")
+    dataset = ds.dataset(directory, format="parquet", partitioning=keys)
+    condition = ds.field("date").is_valid()
+    if channel_id is not None:
+        condition &= ds.field("channel") == channel_id
+    if start:
+        condition &= ds.field("day") >= start.strftime("%Y-%m-%d")
+        condition &= ds.field("date") >= pd.Timestamp(start, tz="UTC")
+    if end:
+        condition &= ds.field("date") < pd.Timestamp(end, tz="UTC")
+    table = dataset.to_table(columns=list(FIELDS), filter=condition)
+    return table.to_pandas().astype(FIELDS)
+
+
+def heatmap(frame):
+    """Message counts by weekday (rows, Monday first) and UTC hour (columns), a 7x24 frame."""
+    dates = frame["date"]
+    counts = np.bincount(dates.dt.weekday.to_numpy() * 24 + dates.dt.hour.to_numpy(), minlength=7 * 24)
+    return pd.DataFrame(counts.reshape(7, 24), index=["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"],
+                        columns=range(24))
+
+
+def top_posters(frame, n=20):
+    """The `n` most active from_ids with their message count, views and forwards."""
+    posters = frame.dropna(subset=["from_id"]).groupby("from_id").agg(
+        messages=("id", "size"), views=("views", "sum"), forwards=("forwards", "sum"))
+    return posters.nlargest(n, "messages")
+
+
+def reply_graph(frame):
+    """Edges from_id -> replied-to author with the number of replies, heaviest first.
+
+    Replies to messages outside the loaded range have no known author and are left out.
+    """
+    # Merged on plain int64 columns; the nullable dtypes make the join several times slower
+    replies = frame.loc[frame["reply_to_msg_id"].notna() & frame["from_id"].notna(),
+                        ["channel_id", "from_id", "reply_to_msg_id"]].astype("int64")
+    authors = frame.loc[frame["from_id"].notna(), ["channel_id", "id", "from_id"]].astype("int64")
+    authors = authors[authors["id"].isin(replies["reply_to_msg_id"])].rename(
+        columns={"id": "reply_to_msg_id", "from_id": "to_id"})
+    edges = replies.merge(authors, on=["channel_id", "reply_to_msg_id"])
+    edges = edges.groupby(["from_id", "to_id"]).size().rename("replies").reset_index()
+    return edges.sort_values("replies", ascending=False, ignore_index=True)
+
+
+def forward_graph(frame):
+    """Edges forward source -> channel with the number of forwarded messages and their views."""
+    forwards = frame.loc[frame["fwd_from_id"].notna()]
+    edges = forwards.groupby(["fwd_from_id", "channel_id"]).agg(
+        messages=("id", "size"), views=("views", "sum")).reset_index()
+    return edges.sort_values("messages", ascending=False, ignore_index=True)
+
+
+def activity_spikes(frame, freq="1h", window=24, threshold=3.0):
+    """Periods whose message count is `threshold` standard deviations above the trailing `window` periods."""
+    counts = frame.set_index("date").resample(freq).size()
+    trailing = counts.shift(1).rolling(window, min_periods=window)
+    mean, std = trailing.mean(), trailing.std()
+    score = (counts - mean) / std.where(std > 0)
+    spikes = pd.DataFrame({"messages": counts, "baseline": mean, "score": score})
+    return spikes[spikes["score"] >= threshold]
+
+
+class Analytics:
+    """Loads a channel/date range once and answers every report from the same arrays.
+
+    `load(channel_id, start, end)` returns the frame (load_from_mongo or
+    load_from_parquet bound to their source). Frames and reports are cached by
+    (channel_id, start, end), so repeated and differently parameterised reports over
+    one range only load it once; the least recently used range is evicted past
+    `max_entries`.
+    """
+
+    def __init__(self, load, max_entries=CACHE_ENTRIES):
+        self.load = load
+        self.max_entries = max_entries
+        self.cache = OrderedDict()  # (channel_id, start, end) -> {"frame": DataFrame, report key: result}
+
+    def _entry(self, channel_id, start, end):
+        key = (channel_id, start, end)
+        entry = self.cache.get(key)
+        if entry is None:
+            entry = self.cache[key] = {"frame": self.load(channel_id, start, end)}
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+        self.cache.move_to_end(key)
+        return entry
+
+    def _report(self, function, channel_id, start, end, **options):
+        entry = self._entry(channel_id, start, end)
+        key = (function.__name__, tuple(sorted(options.items())))
+        if key not in entry:
+            entry[key] = function(entry["frame"], **options)
+        return entry[key]
+
+    def frame(self, channel_id=None, start=None, end=None):
+        return self._entry(channel_id, start, end)["frame"]
+
+    def heatmap(self, channel_id=None, start=None, end=None):
+        return self._report(heatmap, channel_id, start, end)
+
+    def top_posters(self, channel_id=None, start=None, end=None, n=20):
+        return self._report(top_posters, channel_id, start, end, n=n)
+
+    def reply_graph(self, channel_id=None, start=None, end=None):
+        return self._report(reply_graph, channel_id, start, end)
+
+    def forward_graph(self, channel_id=None, start=None, end=None):
+        return self._report(forward_graph, channel_id, start, end)
+
+    def activity_spikes(self, channel_id=None, start=None, end=None, freq="1h", window=24, threshold=3.0):
+        return self._report(activity_spikes, channel_id, start, end, freq=freq, window=window, threshold=threshold)
+
+
+if __name__ == "__main__":
+    # python analytics.py [channel_id] [start YYYY-MM-DD] [end YYYY-MM-DD] [--parquet directory]
+    arguments = sys.argv[1:]
+    directory = None
+    if "--parquet" in arguments:
+        index = arguments.index("--parquet")
+        directory = arguments[index + 1]
+        del arguments[index:index + 2]
+    channel_id = int(arguments[0]) if len(arguments) > 0 and arguments[0] != "-" else None
+    start = datetime.strptime(arguments[1], "%Y-%m-%d") if len(arguments) > 1 else None
+    end = datetime.strptime(arguments[2], "%Y-%m-%d") if len(arguments) > 2 else None
+
+    if directory:
+        analytics = Analytics(lambda *key: load_from_parquet(directory, *key))
+    else:
+        messages = MongoClient('localhost', 27017)['Telegram']['messages']
+        analytics = Analytics(lambda *key: load_from_mongo(messages, *key))
+    print(f"{len(analytics.frame(channel_id, start, end))} messages")
+    print("Messages by weekday and hour (UTC):")
+    print(analytics.heatmap(channel_id, start, end).to_string())
+    print("Top posters:")
+    print(analytics.top_posters(channel_id, start, end).to_string())
+    print("Reply graph (heaviest edges):")
+    print(analytics.reply_graph(channel_id, start, end).head(20).to_string())
+    print("Forward graph (heaviest edges):")
+    print(analytics.forward_graph(channel_id, start, end).head(20).to_string())
+    print("Activity spikes:")
+    print(analytics.activity_spikes(channel_id, start, end).to_string())
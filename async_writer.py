@@ -0,0 +1,104 @@
+import asyncio
+import contextvars
+import queue
+import threading
+import traceback
+
+
+class ThreadedMessageWriter:
+    """Runs a BulkMessageWriter on a dedicated thread, fed by a bounded queue of pages.
+
+    `await add(documents)` only waits when `max_pages` pages are already queued, so the
+    event loop keeps fetching page N+1 while page N is written. Checkpoint callbacks
+    given to after_flush() run on the writer thread, in order, once the pages queued
+    before them are written. A failed write is raised from the next add() or flush(),
+    and no callback runs after it, so no checkpoint moves past the lost page. Every
+    item runs in a copy of the context it was queued from, so metrics recorded on the
+    writer thread keep the channel label of the task that queued them.
+    """
+
+    def __init__(self, writer, max_pages=8, verbose=True):
+        self.writer = writer
+        self.max_pages = max_pages
+        self.verbose = verbose
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="mongo-writer", daemon=True)
+        self.loop = None
+        self.slots = None
+        self.error = None
+
+    def start(self):
+        """Start the writer thread; call from inside the event loop."""
+        self.loop = asyncio.get_running_loop()
+        self.slots = asyncio.Semaphore(self.max_pages)
+        self.thread.start()
+
+    def on_insert(self, hook):
+        """See BulkMessageWriter.on_insert; the hook runs on the writer thread."""
+        self.writer.on_insert(hook)
+
+    def on_write(self, hook):
+        """See BulkMessageWriter.on_write; the hook runs on the writer thread."""
+        self.writer.on_write(hook)
+
+    async def add(self, documents):
+        """Queue one page of documents, waiting while `max_pages` pages are not written yet."""
+        self._raise_error()
+        await self.slots.acquire()
+        self.queue.put(("add", documents, contextvars.copy_context()))
+
+    def after_flush(self, callback):
+        """Call `callback` on the writer thread once everything queued so far is written."""
+        self.queue.put(("after_flush", callback, contextvars.copy_context()))
+
+    async def flush(self):
+        """Write everything queued so far and wait for it."""
+        done = self.loop.create_future()
+        self.queue.put(("flush", done, contextvars.copy_context()))
+        await done
+        self._raise_error()
+
+    async def close(self):
+        """Flush and stop the writer thread."""
+        try:
+            await self.flush()
+        finally:
+            self.queue.put(None)
+            await asyncio.to_thread(self.thread.join)
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            kind, payload, context = item
+            try:
+                if kind == "add":
+                    counts = context.run(self.writer.add, payload)
+                    if counts and self.verbose:
+                        print(f"Saved batch to MongoDB: {counts['inserted']} inserted, {counts['updated']} updated, "
+                              f"{counts['unchanged']} unchanged.")
+                elif kind == "after_flush":
+                    # After a failed write every later callback is dropped: the failed page's own one
+                    # would otherwise run at once (the writer has nothing pending), and later pages'
+                    # ones would move the checkpoint past the lost page
+                    if self.error is None:
+                        context.run(self.writer.after_flush, payload)
+                else:
+                    context.run(self.writer.flush)
+            except Exception as error:
+                # The failed batch and the callbacks waiting for it are dropped by the writer
+                traceback.print_exc()
+                self.error = self.error or error
+            finally:
+                if kind == "add":
+                    self.loop.call_soon_threadsafe(self.slots.release)
+                elif kind == "flush":
+                    self.loop.call_soon_threadsafe(payload.set_result, None)
+
+    def report(self):
+        return self.writer.report()
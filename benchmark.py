@@ -0,0 +1,216 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from contextlib import aclosing
+from datetime import datetime, timezone
+from rate_limiter import AdaptiveRateLimiter
+from concurrent_crawl import crawl_channels
+import metrics
+from checkpoints import CheckpointStore, iter_checkpointed_pages
+from message_stream import latency_percentiles, peak_rss_mb
+from mongo_writer import BulkMessageWriter
+from async_writer import ThreadedMessageWriter
+from mongo_schema import ensure_indexes
+from rollups import ActivityRollups
+from serializer import serialize
+from fake_telegram import FakeTelegramClient
+
+RESULTS_DIR = "bench_results"
+# mongomock's bulk upserts slow down quadratically with the collection size, so runs on it default
+# to a size that finishes in seconds; runs of more than MOCK_MAX_MESSAGES messages in all need --mongo
+MONGO_MESSAGES = 20000
+MOCK_MESSAGES = 500
+MOCK_MAX_MESSAGES = 10000
+WRITE_OPERATIONS = ("bulk_write", "insert_one", "insert_many", "update_one", "update_many", "replace_one",
+                    "delete_one", "delete_many", "find_one_and_update")
+READ_OPERATIONS = ("find", "find_one", "aggregate", "count_documents")
+
+
+class CountingCollection:
+    """Wraps a pymongo collection and counts the calls (and bulk operations) made through it."""
+
+    def __init__(self, collection, counts):
+        self.collection = collection
+        self.counts = counts
+
+    def with_options(self, **kwargs):
+        return CountingCollection(self.collection.with_options(**kwargs), self.counts)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.collection, name)
+        if name not in WRITE_OPERATIONS + READ_OPERATIONS:
+            return attribute
+
+        def counted(*args, **kwargs):
+            key = f"{self.collection.name}.{name}"
+            self.counts[key] = self.counts.get(key, 0) + 1
+            if name == "bulk_write":
+                key = f"{self.collection.name}.bulk_operations"
+                self.counts[key] = self.counts.get(key, 0) + len(args[0])
+            return attribute(*args, **kwargs)
+        return counted
+
+
+def open_database(use_mongo):
+    """A fresh benchmark database: a local MongoDB when asked for, mongomock otherwise."""
+    if use_mongo:
+        from pymongo import MongoClient
+        client = MongoClient('localhost', 27017)
+    else:
+        # In-process stand-in. Its upserts scan the whole collection, so save latencies grow with the
+        # run; compare them only between runs of the same size, and use --mongo for real write numbers.
+        # It also ignores the $$NOW update pipeline of BulkMessageWriter, see run()
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("The default in-process backend needs mongomock: pip install -r requirements-dev.txt, "
+                     "or pass --mongo to use a local MongoDB")
+        client = mongomock.MongoClient()
+    client.drop_database('Telegram_bench')
+    return client['Telegram_bench']
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    db = open_database(args.mongo)
+    ensure_indexes(db)
+    counts = {}
+    writer = BulkMessageWriter(CountingCollection(db['messages'], counts), batch_pages=args.batch_pages)
+    writer.on_insert(ActivityRollups(CountingCollection(db['activity_rollups'], counts)).record)
+    checkpoints = CheckpointStore(CountingCollection(db['checkpoints'], counts))
+    rate_limiter = AdaptiveRateLimiter({"history": args.rate, "get_entity": args.rate})
+    client = FakeTelegramClient(messages_per_channel=args.messages, latency=args.latency / 1000,
+                                jitter=args.jitter / 1000, flood_rate=args.flood_rate, seed=args.seed)
+    save_latencies = []
+    threaded = ThreadedMessageWriter(writer, max_pages=args.write_queue, verbose=False) if args.write_queue else None
+    if threaded:
+        threaded.start()
+
+    # The same path as fetch_messages in the Mongo crawlers: checkpointed pages into the bulk writer
+    async def fetch(client, chat_name):
+        chat_info = await rate_limiter.call("get_entity", client.get_entity, chat_name)
+        count = 0
+        pages = iter_checkpointed_pages(client, chat_info, chat_name, checkpoints, rate_limiter, args.page_size,
+                                        on_durable=(threaded or writer).after_flush, prefetch=args.prefetch)
+        async with aclosing(pages):
+            async for messages in pages:
+                started = time.perf_counter()
+                with metrics.SERIALIZE_SECONDS.time():
+                    documents = [serialize(message, args.mode) for message in messages]
+                if threaded:
+                    await threaded.add(documents)
+                else:
+                    writer.add(documents)
+                save_latencies.append(time.perf_counter() - started)
+                count += len(messages)
+        if threaded:
+            await threaded.flush()
+        else:
+            writer.flush()
+        return {"count": count, "channel": chat_info}
+
+    channels = [f"bench_channel_{index}" for index in range(args.channels)]
+    started = time.perf_counter()
+    progress = await crawl_channels(client, channels, fetch, concurrency=args.concurrency)
+    if threaded:
+        await threaded.close()
+    elapsed = time.perf_counter() - started
+    total = sum(count for count in progress.values() if isinstance(count, int))
+
+    notes = []
+    upserts = dict(writer.stats)
+    if not args.mongo:
+        # mongomock counts every matched pipeline upsert as modified, so updated vs unchanged is meaningless
+        upserts = {"inserted": writer.stats["inserted"],
+                   "matched": writer.stats["updated"] + writer.stats["unchanged"]}
+        notes.append("mongomock: updated_at is not set and updates are not told apart from unchanged "
+                     "re-upserts; use --mongo for those")
+
+    return {
+        "commit": git_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "backend": "mongodb" if args.mongo else "mongomock",
+        "config": vars(args),
+        "messages": total,
+        "seconds": elapsed,
+        "messages_per_second": total / elapsed if elapsed else 0,
+        # Fake API time per page; page_wall_latency adds the time the event loop took to resume the fetch
+        "page_latency": latency_percentiles(client.latencies),
+        "page_wall_latency": latency_percentiles(client.wall_latencies),
+        "save_latency": latency_percentiles(save_latencies),
+        "flood_waits": client.flood_waits,
+        "peak_rss_mb": peak_rss_mb(),
+        "mongo_ops": dict(sorted(counts.items())),
+        "upserts": upserts,
+        "stages": metrics.summary(),
+        "notes": notes,
+    }
+
+
+def compare(result, baseline_path):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    before, after = baseline["messages_per_second"], result["messages_per_second"]
+    print(f"vs {baseline.get('commit')}: {before:.0f} -> {after:.0f} msgs/s ({(after / before - 1) * 100:+.1f}%), "
+          f"p95 page {baseline['page_latency'].get('p95_ms', 0):.1f} -> {result['page_latency'].get('p95_ms', 0):.1f} ms, "
+          f"peak RSS {baseline['peak_rss_mb']:.0f} -> {result['peak_rss_mb']:.0f} MB")
+
+
+if __name__ == "__main__":
+    # python benchmark.py [--channels 4 --messages 500 --latency 50 --flood-rate 0.01] [--compare old.json]
+    # python benchmark.py --mongo [--messages 20000 ...]
+    parser = argparse.ArgumentParser(description="End-to-end crawler benchmark against a fake Telegram")
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--messages", type=int,
+                        help=f"messages per channel (default {MONGO_MESSAGES} with --mongo, {MOCK_MESSAGES} without)")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=50, help="ms per request")
+    parser.add_argument("--jitter", type=float, default=20, help="extra random ms per request")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="fraction of requests failing with FloodWait")
+    parser.add_argument("--rate", type=float, default=30, help="history requests per second")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--prefetch", type=int, default=1)
+    parser.add_argument("--batch-pages", type=int, default=1)
+    parser.add_argument("--write-queue", type=int, default=0,
+                        help="write on a writer thread with this many pages queued (0: write inline)")
+    parser.add_argument("--mode", choices=("lean", "full"), default="lean")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mongo", action="store_true", help="use MongoDB on localhost instead of mongomock")
+    parser.add_argument("--output", help=f"result file, by default under {RESULTS_DIR}/")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+    if args.messages is None:
+        args.messages = MONGO_MESSAGES if args.mongo else MOCK_MESSAGES
+    if not args.mongo and args.channels * args.messages > MOCK_MAX_MESSAGES:
+        parser.error(f"more than {MOCK_MAX_MESSAGES} messages in all are too slow on mongomock; pass --mongo")
+
+    result = asyncio.run(run(args))
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now():%Y%m%d_%H%M%S}_{result['commit'] or 'nogit'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+
+    print(f"{result['messages']} messages in {result['seconds']:.1f}s: {result['messages_per_second']:.0f} msgs/s")
+    print(f"Page latency: {result['page_latency']}")
+    print(f"Page latency with event loop delays: {result['page_wall_latency']}")
+    print(f"Save latency: {result['save_latency']}")
+    print(f"FloodWaits: {result['flood_waits']}, peak RSS {result['peak_rss_mb']:.1f} MB")
+    print(f"Mongo ops: {result['mongo_ops']}")
+    print(f"Upserts: {result['upserts']}")
+    for note in result['notes']:
+        print(f"Note: {note}")
+    print(f"Saved {output}")
+    if args.compare:
+        compare(result, args.compare)
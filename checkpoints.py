@@ -0,0 +1,74 @@
+from contextlib import aclosing
+from datetime import datetime, timezone
+from functools import partial
+from telethon import utils
+from message_stream import stream_pages
+
+
+class CheckpointStore:
+    """Per-channel high-water marks, kept in Mongo next to the messages collection.
+
+    Each document is keyed by the channel's peer id and holds `newest_id`, the newest
+    message id already ingested, and `oldest_id`, the oldest one the backfill reached.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def get(self, channel_id):
+        return self.collection.find_one({"_id": channel_id}) or {}
+
+    def update(self, channel_id, chat_name, newest_id=None, oldest_id=None, backfill_done=None):
+        """Move the marks of a channel; newest_id only grows and oldest_id only shrinks."""
+        update = {"$set": {"chat_name": chat_name, "updated_at": datetime.now(timezone.utc)}}
+        if newest_id is not None:
+            update["$max"] = {"newest_id": newest_id}
+        if oldest_id is not None:
+            update["$min"] = {"oldest_id": oldest_id}
+        if backfill_done is not None:
+            update["$set"]["backfill_done"] = backfill_done
+        self.collection.update_one({"_id": channel_id}, update, upsert=True)
+
+
+async def iter_checkpointed_pages(client, chat_info, chat_name, checkpoints, rate_limiter, page_size,
+                                  should_stop=lambda: False, on_durable=None, prefetch=1):
+    """Yield pages of a chat, newest first, skipping everything the checkpoint already covers.
+
+    First the messages newer than `newest_id` are fetched (min_id), then an unfinished
+    backfill carries on below `oldest_id` (offset_id). The checkpoint for a page is only
+    moved once the consumer asks for the next page, i.e. after it saved the current one.
+    `on_durable` receives that checkpoint update and may defer it until the page is
+    really written; by default it is applied straight away.
+    """
+    channel_id = utils.get_peer_id(chat_info)
+    checkpoint = checkpoints.get(channel_id)
+    commit = on_durable or (lambda update: update())
+
+    # Catch up on messages posted since the previous run
+    newest_id = checkpoint.get("newest_id", 0)
+    if newest_id:
+        top_id = None
+        pages = stream_pages(client, chat_info, rate_limiter, page_size, min_id=newest_id,
+                             prefetch=prefetch, should_stop=should_stop)
+        async with aclosing(pages):
+            async for messages in pages:
+                top_id = top_id or messages[0].id
+                yield messages
+        if should_stop():
+            return  # Leave newest_id alone so the next run fetches the gap again
+        # newest_id only moves once the whole gap is saved, otherwise a rerun would skip its rest
+        if top_id:
+            commit(partial(checkpoints.update, channel_id, chat_name, newest_id=top_id))
+
+    # Resume the backfill where the previous run stopped
+    if checkpoint.get("backfill_done"):
+        return
+    pages = stream_pages(client, chat_info, rate_limiter, page_size, offset_id=checkpoint.get("oldest_id", 0),
+                         prefetch=prefetch, should_stop=should_stop)
+    async with aclosing(pages):
+        async for messages in pages:
+            yield messages
+            commit(partial(checkpoints.update, channel_id, chat_name,
+                           newest_id=messages[0].id, oldest_id=messages[-1].id))
+    if not should_stop():
+        commit(partial(checkpoints.update, channel_id, chat_name, backfill_done=True))
@@ -0,0 +1,40 @@
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Columnar output is optional
+    pa = pq = None
+
+# Arrow types of the lean message schema (serializer.project_message), in column order
+COLUMNS = [
+    ("id", "int64"),
+    ("channel_id", "int64"),
+    ("from_id", "int64"),
+    ("date", "timestamp"),
+    ("edit_date", "timestamp"),
+    ("text", "string"),
+    ("views", "int64"),
+    ("forwards", "int64"),
+    ("reply_to_msg_id", "int64"),
+    ("fwd_from_id", "int64"),
+    ("fwd_from_msg_id", "int64"),
+    ("fwd_from_date", "timestamp"),
+]
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("Parquet output needs the pyarrow package")
+
+
+def schema():
+    """Arrow schema of lean message documents; dates are UTC microsecond timestamps."""
+    require_pyarrow()
+    types = {"int64": pa.int64(), "string": pa.string(), "timestamp": pa.timestamp("us", tz="UTC")}
+    return pa.schema([(name, types[kind]) for name, kind in COLUMNS])
+
+
+def to_table(documents):
+    """Arrow table of lean message documents; fields outside the schema are left out."""
+    arrow_schema = schema()
+    columns = {name: [document.get(name) for document in documents] for name, _ in COLUMNS}
+    return pa.Table.from_pydict(columns, schema=arrow_schema)
@@ -0,0 +1,33 @@
+import asyncio
+import traceback
+import metrics
+
+
+async def crawl_channels(client, channels, fetch, concurrency=8):
+    """Crawl several channels at once on one client, at most `concurrency` in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+    progress = {}  # channel -> number of messages fetched, or the error that stopped it
+
+    async def crawl_one(chat_name):
+        metrics.channel.set(chat_name)  # Labels every metric recorded for this channel
+        async with semaphore:
+            print(f'Start fetching messages from: {chat_name}')
+            try:
+                result = await fetch(client, chat_name)
+                progress[chat_name] = result["count"]
+            except Exception as error:
+                # A broken channel must not take the other channels down with it
+                traceback.print_exc()
+                progress[chat_name] = error
+            print(f"Finished {chat_name} ({len(progress)}/{len(channels)} channels done)")
+
+    await asyncio.gather(*(crawl_one(chat_name) for chat_name in channels))
+
+    # Print a per-channel summary
+    for chat_name in channels:
+        outcome = progress.get(chat_name)
+        if isinstance(outcome, Exception):
+            print(f"{chat_name}: failed with {outcome!r}")
+        else:
+            print(f"{chat_name}: {outcome} messages")
+    return progress
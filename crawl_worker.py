@@ -0,0 +1,155 @@
+import argparse
+import asyncio
+import signal
+import subprocess
+import sys
+import traceback
+from contextlib import aclosing
+from telethon import TelegramClient
+from pymongo import MongoClient
+from config import Config
+from rate_limiter import AdaptiveRateLimiter
+from entity_cache import EntityCache, MongoEntityStore
+from checkpoints import CheckpointStore, iter_checkpointed_pages
+from leases import LeaseStore
+from message_stream import peak_rss_mb
+from mongo_writer import BulkMessageWriter
+from mongo_schema import ensure_indexes
+from rollups import ActivityRollups
+from serializer import serialize
+from fake_telegram import FakeTelegramClient
+
+# Channels shared out between all workers
+monitoring_channels = ["pal_Online9"]
+FAKE_CHANNELS = [f"fake_channel_{index}" for index in range(16)]  # Crawled by --fake workers
+
+RATE_LIMIT = 30  # history requests per second, per account
+ENTITY_RATE_LIMIT = 1
+MESSAGES_PER_REQUEST = 100
+PREFETCH_PAGES = 1
+CHANNELS_PER_WORKER = 4  # Leases a worker holds at the same time
+LEASE_TTL = 60  # Seconds before a silent worker's channels are handed to another worker
+DATABASE = 'Telegram'  # Fake runs use DATABASE + '_fake' so they never mix with real data
+
+# Global flag to handle graceful shutdown
+stop_signal = False
+
+
+def handle_stop_signal(signum, frame):
+    global stop_signal
+    stop_signal = True
+    print("\nGraceful shutdown initiated...")
+
+
+def accounts():
+    """Credentials pool: Config['accounts'] when several accounts are configured, else the single one."""
+    return Config.get('accounts', [Config])
+
+
+async def crawl_leased_channel(client, chat_name, leases, checkpoints, writer, rate_limiter, entity_cache):
+    """Crawl one channel while holding its lease; stops early if the lease is lost."""
+    lost = asyncio.Event()
+    heartbeat = asyncio.create_task(leases.keep_alive(chat_name, lost))
+    count = 0
+    try:
+        async with entity_cache.peer(client, chat_name, rate_limiter) as chat_info:
+            pages = iter_checkpointed_pages(client, chat_info, chat_name, checkpoints, rate_limiter,
+                                            MESSAGES_PER_REQUEST, should_stop=lambda: stop_signal or lost.is_set(),
+                                            on_durable=writer.after_flush, prefetch=PREFETCH_PAGES)
+            async with aclosing(pages):
+                async for messages in pages:
+                    count += len(messages)
+                    writer.add([serialize(message) for message in messages])
+        # Checkpoints only move after the write, so flush before letting go of the channel
+        writer.flush()
+    finally:
+        heartbeat.cancel()
+    if lost.is_set():
+        print(f"[{chat_name}] Lease lost after {count} messages; another worker carries on")
+        return count
+    leases.release(chat_name, done=not stop_signal)
+    print(f"[{chat_name}] {count} messages")
+    return count
+
+
+def database(fake=False):
+    return MongoClient('localhost', 27017)[f"{DATABASE}_fake" if fake else DATABASE]
+
+
+async def run_worker(account, fake=False):
+    """Claim channels one lease at a time until none are left (or Ctrl+C)."""
+    db = database(fake)
+    ensure_indexes(db)
+    checkpoints = CheckpointStore(db['checkpoints'])
+    leases = LeaseStore(db['channel_leases'], ttl=LEASE_TTL)
+    leases.ensure(FAKE_CHANNELS if fake else monitoring_channels)
+    writer = BulkMessageWriter(db['messages'])
+    writer.on_insert(ActivityRollups(db['activity_rollups']).record)
+    rate_limiter = AdaptiveRateLimiter({"history": RATE_LIMIT, "get_entity": ENTITY_RATE_LIMIT})
+    entity_cache = EntityCache(MongoEntityStore(db['entities']), account['username'])
+    totals = {}
+
+    async def claim_loop(client):
+        while not stop_signal:
+            lease = leases.claim()
+            if lease is None:
+                return
+            chat_name = lease["_id"]
+            try:
+                totals[chat_name] = await crawl_leased_channel(client, chat_name, leases, checkpoints, writer,
+                                                               rate_limiter, entity_cache)
+            except Exception as error:
+                # Hand the channel back so it is retried, possibly by another worker, until it failed too often
+                traceback.print_exc()
+                if leases.fail(chat_name, error):
+                    print(f"[{chat_name}] Failed {leases.max_failures} times; not retrying it (--reset to try again)")
+
+    client_class = FakeTelegramClient if fake else TelegramClient
+    async with client_class(account['username'], account['api_id'], account['api_hash'],
+                            flood_sleep_threshold=0) as client:
+        await asyncio.gather(*(claim_loop(client) for _ in range(CHANNELS_PER_WORKER)))
+
+    print(f"Worker {leases.owner} ({account['username']}): {sum(totals.values())} messages "
+          f"from {len(totals)} channels, {leases.remaining()} channels left, {leases.failed()} failed")
+    print(rate_limiter.report())
+    print(writer.report())
+    print(f"Peak RSS: {peak_rss_mb():.1f} MB")
+
+
+def spawn(count, fake):
+    """Start `count` worker processes, one account each, and wait for them."""
+    pool = accounts()
+    if not fake and count > len(pool):
+        sys.exit(f"{count} workers need {count} accounts, only {len(pool)} configured")
+    ensure_indexes(database(fake))  # Once, before the workers race for the migrations
+    workers = []
+    for index in range(count):
+        command = [sys.executable, __file__, "--account", str(index % len(pool))]
+        if fake:
+            command += ["--fake", "--worker", str(index)]
+        workers.append(subprocess.Popen(command))
+    return max(worker.wait() for worker in workers)
+
+
+if __name__ == "__main__":
+    # python crawl_worker.py [--account N] | --spawn N [--fake] | --reset
+    parser = argparse.ArgumentParser(description="Leased multi-account crawler worker")
+    parser.add_argument("--account", type=int, default=0, help="index into Config['accounts']")
+    parser.add_argument("--spawn", type=int, help="start this many local worker processes")
+    parser.add_argument("--fake", action="store_true", help="crawl synthetic channels instead of Telegram")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--reset", action="store_true", help="mark every channel as not done for a new round")
+    args = parser.parse_args()
+
+    if args.reset:
+        database(args.fake)['channel_leases'].update_many({}, {"$set": {"done": False, "failed": False,
+                                                                        "failures": 0}})
+    elif args.spawn:
+        sys.exit(spawn(args.spawn, args.fake))
+    else:
+        signal.signal(signal.SIGINT, handle_stop_signal)
+        account = dict(accounts()[args.account])
+        if args.fake:
+            # Fake workers may share an account, but each needs a session name of its own
+            account['username'] = f"{account['username']}_fake{args.worker or 0}"
+        asyncio.run(run_worker(account, args.fake))
@@ -0,0 +1,177 @@
+import asyncio
+import signal
+from contextlib import aclosing
+from functools import partial
+from telethon import TelegramClient
+from config import Config
+from rate_limiter import AdaptiveRateLimiter
+from concurrent_crawl import crawl_channels
+from checkpoints import iter_checkpointed_pages
+from message_stream import stream_pages, peak_rss_mb
+import metrics
+
+
+class CrawlEngine:
+    """Fetches every page of a channel once and fans it out to all configured sinks.
+
+    Each sink has its own queue, so a slow sink only holds up the fetch loop once its
+    buffer is full, and a failed sink drops its pages while the others keep going.
+    With `checkpoints`, a page only moves the channel's checkpoint once every sink
+    wrote it. Once any sink drops or fails a page of a channel, that channel's
+    checkpoint stops moving for the rest of the run, so a later page cannot commit past
+    the lost one and the next run fetches it again.
+    """
+
+    def __init__(self, sinks, rate_limiter, entity_cache, checkpoints=None, page_size=100, prefetch=1,
+                 should_stop=lambda: False):
+        self.sinks = sinks
+        self.rate_limiter = rate_limiter
+        self.entity_cache = entity_cache
+        self.checkpoints = checkpoints
+        self.page_size = page_size
+        self.prefetch = prefetch
+        self.should_stop = should_stop
+        self.commits = set()  # Checkpoint updates waiting for their page to be written
+        self.failed = {}  # chat_name -> number of its first page some sink dropped or failed
+
+    def start(self):
+        for sink in self.sinks:
+            sink.start()
+
+    async def _commit_when_written(self, chat_name, page, written, update):
+        results = await asyncio.gather(*written, return_exceptions=True)
+        if any(isinstance(result, Exception) for result in results):
+            return
+        if page < self.failed.get(chat_name, page + 1):  # Pages before the first lost one still commit
+            update()
+
+    def _after_written(self, chat_name, page, written, update):
+        task = asyncio.create_task(self._commit_when_written(chat_name, page, written, update))
+        self.commits.add(task)
+        task.add_done_callback(self.commits.discard)
+
+    async def fetch(self, client, chat_name, limit=None):
+        """Crawl one channel into every sink; the `fetch` callable of crawl_channels."""
+        written = []  # Futures of the last page submitted, one per sink
+        page = 0  # Number of the last page submitted
+        count = 0
+
+        def mark_failed(page, future):
+            # Runs as soon as the page's outcome is known, before any later page of the channel can commit
+            if future.cancelled() or future.exception() is not None:
+                self.failed[chat_name] = min(page, self.failed.get(chat_name, page))
+
+        def on_durable(update):
+            self._after_written(chat_name, page, written, update)  # For the page submitted last
+
+        async with self.entity_cache.peer(client, chat_name, self.rate_limiter) as chat_info:
+            if self.checkpoints is not None:
+                pages = iter_checkpointed_pages(client, chat_info, chat_name, self.checkpoints, self.rate_limiter,
+                                                self.page_size, should_stop=self.should_stop,
+                                                on_durable=on_durable,
+                                                prefetch=self.prefetch)
+            else:
+                pages = stream_pages(client, chat_info, self.rate_limiter, self.page_size, prefetch=self.prefetch,
+                                     should_stop=self.should_stop)
+            async with aclosing(pages):
+                async for messages in pages:
+                    page += 1
+                    written = [await sink.submit(chat_name, messages) for sink in self.sinks]
+                    for future in written:
+                        future.add_done_callback(partial(mark_failed, page))
+                    count += len(messages)
+                    print(f"[{chat_name}] Fetched {count} messages so far...")
+                    if limit and count >= limit:
+                        break
+        return {"count": count, "channel": chat_info}
+
+    async def close(self):
+        """Drain every sink and apply the checkpoints of what they wrote."""
+        for sink in self.sinks:
+            await sink.close()
+        await asyncio.gather(*self.commits)
+
+    def report(self):
+        return "\n".join(sink.report() for sink in self.sinks)
+
+
+# Settings of the multi-sink crawler
+api_id = Config['api_id']
+api_hash = Config['api_hash']
+session_name = Config['username']
+monitoring_channels = ["pal_Online9"]
+
+SINKS = ("jsonl", "mongo")  # Any of "jsonl", "mongo", "parquet"
+RATE_LIMIT = 30
+ENTITY_RATE_LIMIT = 1
+MESSAGES_PER_REQUEST = 100
+PREFETCH_PAGES = 1
+CONCURRENCY = 8
+SINK_QUEUE_PAGES = 64  # Pages a sink may fall behind before the fetch loop waits for it
+SINK_BATCH_PAGES = 8  # Pages written per batch
+OUTPUT_DIR = "."
+METRICS_PORT = metrics.port_from_env()  # Prometheus /metrics port from $METRICS_PORT; off when unset
+
+# Global flag to handle graceful shutdown
+stop_signal = False
+
+
+def handle_stop_signal(signum, frame):
+    global stop_signal
+    stop_signal = True
+    print("\nGraceful shutdown initiated...")
+
+
+def build_sinks():
+    """The configured sinks, plus the checkpoint store and entity cache (Mongo-backed when Mongo is a sink)."""
+    from entity_cache import EntityCache, FileEntityStore, MongoEntityStore
+    options = {"queue_pages": SINK_QUEUE_PAGES, "batch_pages": SINK_BATCH_PAGES}
+    sinks = []
+    checkpoints = None
+    entity_cache = EntityCache(FileEntityStore("entity_cache.json"), session_name)
+    if "jsonl" in SINKS:
+        from jsonl_sink import JsonlSink
+        from sinks import JsonlFileSink
+        sinks.append(JsonlFileSink(JsonlSink(OUTPUT_DIR), **options))
+    if "mongo" in SINKS:
+        from pymongo import MongoClient
+        from checkpoints import CheckpointStore
+        from mongo_schema import ensure_indexes
+        from mongo_writer import BulkMessageWriter
+        from rollups import ActivityRollups
+        from sinks import MongoSink
+        db = MongoClient('localhost', 27017)['Telegram']
+        ensure_indexes(db)
+        writer = BulkMessageWriter(db['messages'])
+        writer.on_insert(ActivityRollups(db['activity_rollups']).record)
+        sinks.append(MongoSink(writer, **options))
+        checkpoints = CheckpointStore(db['checkpoints'])
+        entity_cache = EntityCache(MongoEntityStore(db['entities']), session_name)
+    if "parquet" in SINKS:
+        from sinks import ParquetSink
+        sinks.append(ParquetSink(OUTPUT_DIR, **options))
+    return sinks, checkpoints, entity_cache
+
+
+async def main():
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT)
+    rate_limiter = AdaptiveRateLimiter({"history": RATE_LIMIT, "get_entity": ENTITY_RATE_LIMIT})
+    sinks, checkpoints, entity_cache = build_sinks()
+    engine = CrawlEngine(sinks, rate_limiter, entity_cache, checkpoints, MESSAGES_PER_REQUEST, PREFETCH_PAGES,
+                         should_stop=lambda: stop_signal)
+    engine.start()
+    try:
+        async with TelegramClient(session_name, api_id, api_hash, flood_sleep_threshold=0) as client:
+            await crawl_channels(client, monitoring_channels, engine.fetch, concurrency=CONCURRENCY)
+    finally:
+        # Write what the sinks still hold even when the crawl failed
+        await engine.close()
+    print(rate_limiter.report())
+    print(engine.report())
+    print(f"Peak RSS: {peak_rss_mb():.1f} MB")
+
+
+if __name__ == "__main__":
+    signal.signal(signal.SIGINT, handle_stop_signal)
+    asyncio.run(main())
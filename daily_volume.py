@@ -1,52 +1,70 @@
 import matplotlib.pyplot as plt
 import pandas as pd
 from pymongo import MongoClient
-from collections import defaultdict
-from datetime import datetime
+from rollups import ActivityRollups
 
 # Connect to MongoDB
 client = MongoClient('localhost', 27017)
 db = client['Telegram']  # Database name
 collection = db['messages']  # Collection name
+rollups = ActivityRollups(db['activity_rollups'])  # Maintained by the crawlers while they ingest
 
-# Function to retrieve and calculate daily activity
-def get_daily_activity():
-    # Query to retrieve all messages from the database
-    messages = collection.find({})
+# Optional filters: a channel_id (marked peer id) and a [START_DATE, END_DATE) range
+CHANNEL_ID = None
+START_DATE = None
+END_DATE = None
+USE_ROLLUPS = True  # Read the precomputed daily rollups instead of aggregating the raw messages
 
-    daily_volume = defaultdict(int)
-    daily_users = defaultdict(set)
+# Function to retrieve and calculate daily activity
+def get_daily_activity(channel_id=None, start=None, end=None):
+    # Only dated messages, optionally of one channel and within a date range
+    match = {'date': {'$type': 'date'}}
+    if start:
+        match['date']['$gte'] = start
+    if end:
+        match['date']['$lt'] = end
+    if channel_id is not None:
+        match['channel_id'] = channel_id
 
-    for message in messages:
-        msg_date = message.get('date')
-        user_id = message.get('from_id')
+    # Count messages and distinct users per day inside MongoDB, so only one row per day comes back
+    pipeline = [
+        {'$match': match},
+        {'$project': {'_id': 0, 'from_id': 1,
+                      'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$date'}}}},
+        # One row per (day, user) first, so no per-day set of users has to be held
+        {'$group': {'_id': {'day': '$day', 'user': '$from_id'}, 'messages': {'$sum': 1}}},
+        {'$group': {'_id': '$_id.day',
+                    'messages': {'$sum': '$messages'},
+                    'users': {'$sum': {'$cond': [{'$ifNull': ['$_id.user', False]}, 1, 0]}}}},
+        {'$sort': {'_id': 1}},
+    ]
+    rows = list(collection.aggregate(pipeline, allowDiskUse=True))
 
-        if msg_date and user_id:
-            msg_day = msg_date.strftime('%Y-%m-%d')
-            daily_volume[msg_day] += 1
-            daily_users[msg_day].add(user_id)
-    
     # Print the number of messages per day
-    for day, volume in daily_volume.items():
+    for row in rows:
         print("Messages:")
-        print(f'Date: {day}, Messages: {volume}')
+        print(f'Date: {row["_id"]}, Messages: {row["messages"]}')
 
-    
+    # Convert data to a Pandas DataFrame
+    df = pd.DataFrame([[row['_id'], row['messages'], row['users']] for row in rows],
+                      columns=['Date', 'Message Volume', 'Active Users'])
+    df['Date'] = pd.to_datetime(df['Date'])
 
-    # Prepare data for plotting
-    data = []
-    for day in daily_volume:
-        data.append([day, daily_volume[day], len(daily_users[day])])
+    return df
 
-    # Convert data to a Pandas DataFrame
-    df = pd.DataFrame(data, columns=['Date', 'Message Volume', 'Active Users'])
+# Read daily activity from the rollups: one row per channel and day, no scan of the messages
+def get_daily_activity_from_rollups(channel_id=None, start=None, end=None):
+    rows = rollups.read("day", channel_id, start, end)
+    df = pd.DataFrame(rows, columns=['Date', 'Message Volume', 'Active Users'])
     df['Date'] = pd.to_datetime(df['Date'])
-    df.sort_values('Date', inplace=True)
-    
     return df
 
-# Generate daily activity data
-df = get_daily_activity()
+# Generate daily activity data; the rollups only cover all history once mongo_schema's activity_rollups
+# migration rebuilt them (on the next crawler start), so aggregate the raw messages until then
+if USE_ROLLUPS and db['schema_migrations'].find_one({"_id": "activity_rollups"}):
+    df = get_daily_activity_from_rollups(CHANNEL_ID, START_DATE, END_DATE)
+else:
+    df = get_daily_activity(CHANNEL_ID, START_DATE, END_DATE)
 
 
 print("ffffffffffffffffffffffffffffffffffffffffFF")
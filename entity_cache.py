@@ -0,0 +1,111 @@
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from telethon import utils
+from telethon.errors import ChannelInvalidError, ChannelPrivateError, PeerIdInvalidError
+from telethon.tl import types
+
+# Errors that mean a cached peer (id + access hash) can no longer be used
+INVALID_PEER_ERRORS = (ChannelInvalidError, ChannelPrivateError, PeerIdInvalidError)
+DEFAULT_TTL = 7 * 24 * 3600  # Re-resolve usernames once a week
+
+
+class MongoEntityStore:
+    """Cache records in a MongoDB collection, keyed by _id."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def get(self, key):
+        return self.collection.find_one({"_id": key})
+
+    def put(self, key, record):
+        self.collection.replace_one({"_id": key}, record, upsert=True)
+
+    def delete(self, key):
+        self.collection.delete_one({"_id": key})
+
+
+class FileEntityStore:
+    """Cache records in a local JSON file, rewritten atomically on every change."""
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.records = json.load(f)
+
+    def get(self, key):
+        return self.records.get(key)
+
+    def put(self, key, record):
+        self.records[key] = record
+        self._save()
+
+    def delete(self, key):
+        if self.records.pop(key, None) is not None:
+            self._save()
+
+    def _save(self):
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(self.records, f)
+        os.replace(temporary, self.path)
+
+
+class EntityCache:
+    """Persistent username -> input peer (peer id and access hash) cache with a TTL.
+
+    Access hashes are only valid for the account that resolved them, so entries are
+    kept per `account`. A warm cache resolves a channel list without any get_entity call.
+    """
+
+    def __init__(self, store, account, ttl=DEFAULT_TTL):
+        self.store = store
+        self.account = account
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, username):
+        return f'{self.account}:{username.lower()}'
+
+    async def resolve(self, client, username, rate_limiter=None):
+        """Input peer for `username`, from the cache when fresh, otherwise through get_entity."""
+        record = self.store.get(self._key(username))
+        if record and time.time() - record["resolved_at"] < self.ttl:
+            self.hits += 1
+            peer = dict(record["peer"])
+            return getattr(types, peer.pop("_"))(**peer)
+
+        self.misses += 1
+        if rate_limiter:
+            entity = await rate_limiter.call("get_entity", client.get_entity, username)
+        else:
+            entity = await client.get_entity(username)
+        input_peer = utils.get_input_peer(entity)
+        self.store.put(self._key(username), {
+            "username": username,
+            "peer": input_peer.to_dict(),
+            "peer_id": utils.get_peer_id(input_peer),
+            "resolved_at": time.time(),
+        })
+        return input_peer
+
+    def invalidate(self, username):
+        self.store.delete(self._key(username))
+
+    @asynccontextmanager
+    async def peer(self, client, username, rate_limiter=None):
+        """Resolve `username` for the duration of a block, dropping the entry if Telegram rejects the peer."""
+        input_peer = await self.resolve(client, username, rate_limiter)
+        try:
+            yield input_peer
+        except INVALID_PEER_ERRORS:
+            self.invalidate(username)
+            raise
+
+    def report(self):
+        return f"Entity cache: {self.hits} hits, {self.misses} get_entity calls"
@@ -0,0 +1,81 @@
+import asyncio
+import random
+import time
+import zlib
+from telethon.errors import FloodWaitError
+from telethon.tl.types import Channel, ChatPhotoEmpty
+from synthetic_messages import make_message, START_DATE
+
+
+class FakeTelegramClient:
+    """Stand-in for TelegramClient that serves synthetic channels, for local runs without an account.
+
+    Every username is a channel with `messages_per_channel` messages (ids 1..N). Only
+    what the crawlers use is implemented: get_entity, get_messages with
+    limit/offset_id/min_id, and the connect/disconnect lifecycle. `latency` (plus up
+    to `jitter`) adds a simulated round trip to every request, and a `flood_rate`
+    fraction of the requests fails with a FloodWaitError of `flood_seconds`.
+    """
+
+    def __init__(self, session=None, api_id=None, api_hash=None, messages_per_channel=10000, latency=0.0,
+                 jitter=0.0, flood_rate=0.0, flood_seconds=1, seed=0, **kwargs):
+        self.session = session
+        self.messages_per_channel = messages_per_channel
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.flood_waits = 0
+        # Seconds per get_messages call, synthesis included: the simulated round trip as drawn, so time
+        # the event loop took to resume the caller (blocked by other work) is not counted as API latency
+        self.latencies = []
+        self.wall_latencies = []  # The same calls timed from call to return, event loop delays included
+
+    @staticmethod
+    def channel_id(username):
+        return zlib.crc32(username.lower().encode('utf-8')) & 0x7fffffff
+
+    async def _round_trip(self):
+        """Simulate one request; returns the seconds it was meant to take."""
+        self.requests += 1
+        delay = self.latency + self.rng.random() * self.jitter
+        await asyncio.sleep(delay)
+        if self.rng.random() < self.flood_rate:
+            self.flood_waits += 1
+            raise FloodWaitError(request=None, capture=self.flood_seconds)
+        return delay
+
+    async def get_entity(self, username):
+        await self._round_trip()
+        channel_id = self.channel_id(username)
+        return Channel(id=channel_id, title=username, photo=ChatPhotoEmpty(), date=START_DATE,
+                       access_hash=channel_id * 7, username=username)
+
+    async def get_messages(self, entity, limit=100, offset_id=0, min_id=0, **kwargs):
+        called = time.perf_counter()
+        delay = await self._round_trip()
+        started = time.perf_counter()
+        channel_id = getattr(entity, 'channel_id', None) or entity.id  # Input peer or Channel
+        top = min(offset_id - 1, self.messages_per_channel) if offset_id else self.messages_per_channel
+        ids = range(top, max(min_id, top - limit), -1)
+        # Seeded per message so every worker sees the same content for the same id
+        messages = [make_message(message_id, channel_id, random.Random(channel_id * 1000003 + message_id))
+                    for message_id in ids]
+        finished = time.perf_counter()
+        self.latencies.append(delay + finished - started)
+        self.wall_latencies.append(finished - called)
+        return messages
+
+    async def start(self):
+        return self
+
+    async def disconnect(self):
+        pass
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.disconnect()
@@ -0,0 +1,216 @@
+import asyncio
+import signal
+import time
+import traceback
+from contextlib import aclosing
+from datetime import datetime, timezone
+from functools import partial
+from telethon import TelegramClient, events, utils
+from pymongo import MongoClient
+from config import Config
+from rate_limiter import AdaptiveRateLimiter
+from entity_cache import EntityCache, MongoEntityStore
+from checkpoints import CheckpointStore
+from message_stream import stream_pages, summarize_latencies
+from mongo_writer import BulkMessageWriter
+from mongo_schema import ensure_indexes
+from rollups import ActivityRollups
+from search import SearchIndex
+from serializer import serialize
+
+# MongoDB setup
+db = MongoClient('localhost', 27017)['Telegram']
+ensure_indexes(db)
+checkpoints = CheckpointStore(db['checkpoints'])
+writer = BulkMessageWriter(db['messages'])
+writer.on_insert(ActivityRollups(db['activity_rollups']).record)
+writer.on_write(SearchIndex("search.sqlite3").record)  # Live edits reach the search index too
+
+# Get credentials from the Config.py file
+api_id = Config['api_id']
+api_hash = Config['api_hash']
+session_name = Config['username']
+monitoring_channels = ["pal_Online9"]
+
+RATE_LIMIT = 30
+ENTITY_RATE_LIMIT = 1
+MESSAGES_PER_REQUEST = 100
+BATCH_MESSAGES = 200  # Write a micro-batch once it holds this many messages...
+BATCH_DELAY = 0.5  # ...or once its oldest message waited this many seconds
+GAP_FILL_LIMIT = 5000  # Most messages fetched per channel to cover a disconnect
+RECONNECT_DELAY = 5  # Seconds between reconnect attempts, doubled up to MAX_RECONNECT_DELAY
+MAX_RECONNECT_DELAY = 300
+
+rate_limiter = AdaptiveRateLimiter({"history": RATE_LIMIT, "get_entity": ENTITY_RATE_LIMIT})
+entity_cache = EntityCache(MongoEntityStore(db['entities']), session_name)
+
+
+class MicroBatcher:
+    """Buffers live messages and hands them to the writer by size or by time.
+
+    New messages move the channel's newest_id checkpoint once written, except for
+    channels in `held`: those still have a gap to fill, and moving newest_id past
+    the gap would make the next batch crawl skip it. Writes run on a thread, one at
+    a time, so the event loop keeps receiving updates meanwhile.
+    """
+
+    def __init__(self, writer, checkpoints, max_messages=BATCH_MESSAGES, max_delay=BATCH_DELAY):
+        self.writer = writer
+        self.checkpoints = checkpoints
+        self.max_messages = max_messages
+        self.max_delay = max_delay
+        self.documents = []
+        self.newest = {}  # channel_id -> (chat_name, newest new message id) in the pending batch
+        self.first_added = None
+        self.held = set()
+        self.latencies = []  # Seconds from posting to being written, for new messages
+        self.posted = []  # Post dates of the new messages in the pending batch
+        self.lock = asyncio.Lock()  # The writer is not thread-safe, and batches must land in order
+
+    def _write(self, documents, updates):
+        self.writer.add(documents)
+        for update in updates:
+            self.writer.after_flush(update)
+        self.writer.flush()
+
+    async def write(self, documents, updates=()):
+        """Write documents, then apply the checkpoint updates, on a thread."""
+        async with self.lock:
+            await asyncio.to_thread(self._write, documents, updates)
+
+    async def add(self, chat_name, message, edited=False):
+        document = serialize(message)  # The writer bumps updated_at, since an edit changes edit_date
+        self.documents.append(document)
+        if not edited:
+            channel_id = document["channel_id"]
+            newest_id = max(self.newest.get(channel_id, (None, 0))[1], message.id)
+            self.newest[channel_id] = (chat_name, newest_id)
+            self.posted.append(message.date)
+        if self.first_added is None:
+            self.first_added = time.monotonic()
+        if len(self.documents) >= self.max_messages:
+            await self.flush()
+
+    async def flush(self):
+        if not self.documents:
+            return
+        documents, newest, posted = self.documents, self.newest, self.posted
+        self.documents, self.newest, self.posted, self.first_added = [], {}, [], None
+        updates = [partial(self.checkpoints.update, channel_id, chat_name, newest_id=newest_id)
+                   for channel_id, (chat_name, newest_id) in newest.items() if channel_id not in self.held]
+        try:
+            await self.write(documents, updates)
+        except Exception:
+            # The batch is lost; keeping newest_id of its channels where it is lets the next gap fill refetch it
+            self.held.update(newest)
+            raise
+        now = datetime.now(timezone.utc)
+        self.latencies.extend((now - date).total_seconds() for date in posted)
+        del self.latencies[:-10000]  # Only the recent ones matter for the summary
+
+    async def run(self):
+        """Flush whatever has waited `max_delay` seconds; runs until cancelled."""
+        while True:
+            if self.first_added is None:
+                await asyncio.sleep(self.max_delay)
+                continue
+            wait = self.first_added + self.max_delay - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            try:
+                await self.flush()
+            except Exception:
+                traceback.print_exc()  # Keep flushing later batches
+
+
+async def fill_gap(client, chat_name, chat_info, batcher):
+    """Fetch what was posted while we were not listening, at most GAP_FILL_LIMIT messages."""
+    channel_id = utils.get_peer_id(chat_info)
+    newest_id = (await asyncio.to_thread(checkpoints.get, channel_id)).get("newest_id", 0)
+    if not newest_id:
+        print(f"[{chat_name}] No checkpoint yet; run the batch crawler once to backfill it")
+        return
+    batcher.held.add(channel_id)
+    count = 0
+    top_id = None
+    pages = stream_pages(client, chat_info, rate_limiter, MESSAGES_PER_REQUEST, min_id=newest_id)
+    async with aclosing(pages):
+        async for messages in pages:
+            top_id = top_id or messages[0].id
+            count += len(messages)
+            await batcher.write([serialize(message) for message in messages])
+            if count >= GAP_FILL_LIMIT:
+                # Live messages move newest_id again from here, so the ids below this page stay unfetched
+                batcher.held.discard(channel_id)
+                print(f"[{chat_name}] Gap larger than {GAP_FILL_LIMIT} messages; ids {newest_id + 1} to "
+                      f"{messages[-1].id - 1} are left unfetched")
+                return
+    if top_id:
+        await batcher.write([], [partial(checkpoints.update, channel_id, chat_name, newest_id=top_id)])
+    batcher.held.discard(channel_id)
+    print(f"[{chat_name}] Filled a gap of {count} messages")
+
+
+async def follow(client, batcher):
+    """Stream new and edited messages of monitoring_channels until the client disconnects."""
+    peers = {}
+    for chat_name in monitoring_channels:
+        peers[chat_name] = await entity_cache.resolve(client, chat_name, rate_limiter)
+    names = {utils.get_peer_id(peer): chat_name for chat_name, peer in peers.items()}
+
+    async def on_new_message(event):
+        await batcher.add(names[event.chat_id], event.message)
+
+    async def on_message_edited(event):
+        await batcher.add(names[event.chat_id], event.message, edited=True)
+
+    # Handlers go in before the gap fill so nothing posted during it is missed; duplicates are upserts
+    client.add_event_handler(on_new_message, events.NewMessage(chats=list(peers.values())))
+    client.add_event_handler(on_message_edited, events.MessageEdited(chats=list(peers.values())))
+    await asyncio.gather(*(fill_gap(client, chat_name, peer, batcher) for chat_name, peer in peers.items()))
+    print(f"Following {len(peers)} channels")
+    await client.disconnected
+
+
+async def main():
+    batcher = MicroBatcher(writer, checkpoints)
+    flusher = asyncio.create_task(batcher.run())
+    stopping = asyncio.Event()
+    delay = RECONNECT_DELAY
+    client = None
+
+    def handle_stop_signal():
+        print("\nGraceful shutdown initiated...")
+        stopping.set()
+        if client is not None:
+            asyncio.ensure_future(client.disconnect())
+
+    asyncio.get_running_loop().add_signal_handler(signal.SIGINT, handle_stop_signal)
+
+    try:
+        # We reconnect ourselves, so every reconnect goes through the gap fill
+        while not stopping.is_set():
+            client = TelegramClient(session_name, api_id, api_hash, flood_sleep_threshold=0, auto_reconnect=False)
+            try:
+                async with client:
+                    delay = RECONNECT_DELAY
+                    await follow(client, batcher)
+            except (ConnectionError, OSError) as error:
+                print(f"Connection lost: {error!r}")
+            if stopping.is_set():
+                break
+            print(f"Reconnecting in {delay}s...")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+    finally:
+        # Whatever ends the loop, the buffered messages and their checkpoints are written
+        flusher.cancel()
+        await batcher.flush()
+    print(f"Ingest latency: {summarize_latencies(batcher.latencies)}")
+    print(rate_limiter.report())
+    print(writer.report())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
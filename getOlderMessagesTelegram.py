@@ -3,59 +3,74 @@ from telethon import TelegramClient
 from telethon.tl.functions.messages import GetHistoryRequest
 import asyncio
 from config import Config
+from rate_limiter import AdaptiveRateLimiter
+from entity_cache import EntityCache, FileEntityStore
+from message_stream import summarize_latencies
 
 # Get credentials from Config.py
 api_id = Config['api_id']
 api_hash = Config['api_hash']
 session_name = Config['username']
 message_per_channel = 100  # Retrieve a max of 100 messages per request
+RATE_LIMIT = 30  # history requests per second
+ENTITY_RATE_LIMIT = 1  # get_entity resolves usernames, which Telegram limits much more tightly
+
+# Paces every request and waits out FloodWaitError instead of sleeping a fixed time
+rate_limiter = AdaptiveRateLimiter({"history": RATE_LIMIT, "get_entity": ENTITY_RATE_LIMIT})
+entity_cache = EntityCache(FileEntityStore("entity_cache.json"), session_name)  # Skips get_entity on warm starts
 
 monitoring_channels = ["pal_Online9"]  # Add your channels here
 
-# Coroutine to get old messages in batches
-async def get_old_messages(chat_name, limit, offset_id):
-    async with TelegramClient(session_name, api_id, api_hash) as client:
-        chat_info = await client.get_entity(chat_name)
-        
-        # Retrieve messages with offset_id for pagination
-        messages = await client(GetHistoryRequest(
-            peer=chat_info,
-            limit=limit,
-            offset_id=offset_id,
-            offset_date=None,
-            max_id=0,
-            min_id=0,
-            add_offset=0,
-            hash=0
-        ))
-        return messages
-
-# Function to introduce delay for rate limiting
-def rate_limited_get_messages(chat_name):
-    offset_id = 0
-    all_messages = []
+# Coroutine to get one batch of old messages on the shared client
+async def get_old_messages(client, chat_info, limit, offset_id):
+    # Retrieve messages with offset_id for pagination
+    return await rate_limiter.call("history", client, GetHistoryRequest(
+        peer=chat_info,
+        limit=limit,
+        offset_id=offset_id,
+        offset_date=None,
+        max_id=0,
+        min_id=0,
+        add_offset=0,
+        hash=0
+    ))
+
+# Coroutine to page through a channel on one client, paced by the rate limiter
+async def rate_limited_get_messages(client, chat_name):
+    # Resolve the channel once, not once per batch, from the persistent cache when possible;
+    # a peer Telegram rejects (ChannelInvalid, ChannelPrivate, PeerIdInvalid) is dropped from the cache
+    async with entity_cache.peer(client, chat_name, rate_limiter) as chat_info:
+        offset_id = 0
+        total = 0
+        latencies = []
     
-    # Retrieve messages in batches
-    while True:
-        results = asyncio.run(get_old_messages(chat_name=chat_name, limit=message_per_channel, offset_id=offset_id))
-        if not results.messages:
-            break  # Stop if there are no more messages
+        # Retrieve messages in batches
+        while True:
+            started = time.perf_counter()
+            results = await get_old_messages(client, chat_info, limit=message_per_channel, offset_id=offset_id)
+            latencies.append(time.perf_counter() - started)
+            if not results.messages:
+                break  # Stop if there are no more messages
         
-        # Append retrieved messages to the total list
-        all_messages.extend(results.messages)
+            total += len(results.messages)
         
-        # Update offset_id to get older messages in the next request
-        offset_id = results.messages[-1].id
+            # Update offset_id to get older messages in the next request
+            offset_id = results.messages[-1].id
         
-        # Print retrieved batch count
-        print(f"Retrieved {len(results.messages)} messages from {chat_name}")
-        
-        # Introduce delay to avoid hitting the rate limit
-        time.sleep(2)
+            # Print retrieved batch count
+            print(f"Retrieved {len(results.messages)} messages from {chat_name}")
     
-    return all_messages
+        print(f"Per-page latency for {chat_name}: {summarize_latencies(latencies)}")
+        return total
+
+# Main coroutine: one client and one event loop for the whole run
+async def main():
+    async with TelegramClient(session_name, api_id, api_hash, flood_sleep_threshold=0) as client:
+        for chat_name in monitoring_channels:
+            total = await rate_limited_get_messages(client, chat_name)
+            print(f"Total messages retrieved: {total} from {chat_name}")
+
+    print(rate_limiter.report())
+    print(entity_cache.report())
 
-# Main loop to retrieve messages for each channel
-for chat_name in monitoring_channels:
-    all_messages = rate_limited_get_messages(chat_name)
-    print(f"Total messages retrieved: {len(all_messages)} from {chat_name}")
+asyncio.run(main())
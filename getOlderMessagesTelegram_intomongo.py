@@ -1,9 +1,19 @@
 import time
-from telethon import TelegramClient
+from functools import partial
+from telethon import TelegramClient, utils
 from telethon.tl.functions.messages import GetHistoryRequest
 import asyncio
 from pymongo import MongoClient
 from config import Config
+from rate_limiter import AdaptiveRateLimiter
+from entity_cache import EntityCache, MongoEntityStore
+from checkpoints import CheckpointStore
+from message_stream import summarize_latencies
+from mongo_writer import BulkMessageWriter
+from mongo_schema import ensure_indexes
+from rollups import ActivityRollups
+from serializer import serialize
+from pymongo.write_concern import WriteConcern
 
 # Get credentials from Config.py
 api_id = Config['api_id']
@@ -14,71 +24,105 @@ session_name = Config['username']
 client = MongoClient('localhost', 27017)
 db = client['Telegram']  # Database name
 collection = db['messages']  # Collection name
+ensure_indexes(db)  # Unique (channel_id, id) upsert key plus the date indexes readers need
+checkpoints = CheckpointStore(db['checkpoints'])  # Lets a killed backfill resume where it stopped
+
+# Batched writes: one unordered bulk_write per WRITE_BATCH_PAGES pages
+WRITE_BATCH_PAGES = 1
+WRITE_CONCERN = WriteConcern(w=1)
+writer = BulkMessageWriter(collection, batch_pages=WRITE_BATCH_PAGES, write_concern=WRITE_CONCERN)
+
+# Per-channel daily/hourly activity, updated with every newly inserted message
+rollups = ActivityRollups(db['activity_rollups'])
+writer.on_insert(rollups.record)
 
 message_per_channel = 100  # Retrieve a max of 100 messages per request
-monitoring_channels = ["pal_Online9"]  # Add your channels here
+SERIALIZE_MODE = "lean"  # "lean" projected schema or "full" Telethon to_dict output
+RATE_LIMIT = 30  # history requests per second
+ENTITY_RATE_LIMIT = 1  # get_entity resolves usernames, which Telegram limits much more tightly
 
+# Paces every request and waits out FloodWaitError instead of sleeping a fixed time
+rate_limiter = AdaptiveRateLimiter({"history": RATE_LIMIT, "get_entity": ENTITY_RATE_LIMIT})
+entity_cache = EntityCache(MongoEntityStore(db['entities']), session_name)  # Skips get_entity on warm starts
+monitoring_channels = ["pal_Online9"]  # Add your channels here
 
-# Coroutine to get old messages in batches
-async def get_old_messages(chat_name, limit, offset_id):
-    async with TelegramClient(session_name, api_id, api_hash) as client:
-        chat_info = await client.get_entity(chat_name)
 
-        # Retrieve messages with offset_id for pagination
-        messages = await client(GetHistoryRequest(
-            peer=chat_info,
-            limit=limit,
-            offset_id=offset_id,
-            offset_date=None,
-            max_id=0,
-            min_id=0,
-            add_offset=0,
-            hash=0
-        ))
-        return messages
+# Coroutine to get one batch of old messages on the shared client
+async def get_old_messages(client, chat_info, limit, offset_id):
+    # Retrieve messages with offset_id for pagination
+    return await rate_limiter.call("history", client, GetHistoryRequest(
+        peer=chat_info,
+        limit=limit,
+        offset_id=offset_id,
+        offset_date=None,
+        max_id=0,
+        min_id=0,
+        add_offset=0,
+        hash=0
+    ))
 
 
 # Function to save messages to MongoDB without duplicates
 def save_messages_to_mongo(messages):
-    for message in messages:
-        serialized_message = message.to_dict()  # Convert message object to dict
-        collection.update_one(
-            {"id": serialized_message["id"]},  # Check by unique message ID
-            {"$set": serialized_message},  # Insert or update the message
-            upsert=True  # Insert if doesn't exist
-        )
+    # Convert message objects to dicts and upsert them in one unordered bulk write
+    writer.add([serialize(message, SERIALIZE_MODE) for message in messages])
+
+
+# Coroutine to page through a channel on one client, paced by the rate limiter
+async def rate_limited_get_messages(client, chat_name):
+    # Resolve the channel once, not once per batch, from the persistent cache when possible;
+    # a peer Telegram rejects (ChannelInvalid, ChannelPrivate, PeerIdInvalid) is dropped from the cache
+    async with entity_cache.peer(client, chat_name, rate_limiter) as chat_info:
+        channel_id = utils.get_peer_id(chat_info)
+        checkpoint = checkpoints.get(channel_id)
+        if checkpoint.get("backfill_done"):
+            print(f"Backfill of {chat_name} already complete")
+            return 0
+
+        offset_id = checkpoint.get("oldest_id", 0)  # Resume below the oldest message already saved
+        total = 0
+        latencies = []
+
+        # Retrieve messages in batches
+        while True:
+            started = time.perf_counter()
+            results = await get_old_messages(client, chat_info, limit=message_per_channel, offset_id=offset_id)
+            latencies.append(time.perf_counter() - started)
+            if not results.messages:
+                break  # Stop if there are no more messages
 
+            total += len(results.messages)
 
-# Function to introduce delay for rate limiting
-def rate_limited_get_messages(chat_name):
-    offset_id = 0
-    all_messages = []
+            # Save to MongoDB
+            save_messages_to_mongo(results.messages)
 
-    # Retrieve messages in batches
-    while True:
-        results = asyncio.run(get_old_messages(chat_name=chat_name, limit=message_per_channel, offset_id=offset_id))
-        if not results.messages:
-            break  # Stop if there are no more messages
+            # Update offset_id to get older messages in the next request
+            offset_id = results.messages[-1].id
 
-        # Append retrieved messages to the total list
-        all_messages.extend(results.messages)
+            # Move the checkpoint once the batch is written
+            writer.after_flush(partial(checkpoints.update, channel_id, chat_name,
+                                       newest_id=results.messages[0].id, oldest_id=offset_id))
 
-        # Save to MongoDB
-        save_messages_to_mongo(results.messages)
+            # Print retrieved batch count
+            print(f"Retrieved {len(results.messages)} messages from {chat_name}")
 
-        # Update offset_id to get older messages in the next request
-        offset_id = results.messages[-1].id
+        # Write whatever is left of the last batch
+        writer.flush()
+        checkpoints.update(channel_id, chat_name, backfill_done=True)
+        print(f"Per-page latency for {chat_name}: {summarize_latencies(latencies)}")
+        return total
 
-        # Print retrieved batch count
-        print(f"Retrieved {len(results.messages)} messages from {chat_name}")
 
-        # Introduce delay to avoid hitting the rate limit
-        time.sleep(2)
+# Main coroutine: one client and one event loop for the whole run
+async def main():
+    async with TelegramClient(session_name, api_id, api_hash, flood_sleep_threshold=0) as client:
+        for chat_name in monitoring_channels:
+            total = await rate_limited_get_messages(client, chat_name)
+            print(f"Total messages retrieved: {total} from {chat_name}")
 
-    return all_messages
+    print(rate_limiter.report())
+    print(entity_cache.report())
+    print(writer.report())
 
 
-# Main loop to retrieve messages for each channel
-for chat_name in monitoring_channels:
-    all_messages = rate_limited_get_messages(chat_name)
-    print(f"Total messages retrieved: {len(all_messages)} from {chat_name}")
+asyncio.run(main())
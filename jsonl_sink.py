@@ -0,0 +1,91 @@
+import gzip
+import os
+import zlib
+from datetime import datetime
+import metrics
+
+try:
+    import zstandard
+except ImportError:  # zstd output is optional
+    zstandard = None
+
+EXTENSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+class JsonlSink:
+    """Append-only JSONL output with one open file per channel.
+
+    Every page is appended once, so writing a channel costs O(n). A channel's file is
+    rotated to a new part once it holds `max_bytes` bytes (uncompressed) or
+    `max_messages` messages, and can be compressed with "gzip" or "zstd".
+    """
+
+    def __init__(self, directory=".", max_bytes=256 * 1024 * 1024, max_messages=None, compression=None):
+        if compression not in EXTENSIONS:
+            raise ValueError(f"Unknown compression {compression!r}, use one of {list(EXTENSIONS)}")
+        if compression == "zstd" and zstandard is None:
+            raise ImportError("zstd compression needs the zstandard package")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.compression = compression
+        self.started = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+        self.files = {}  # chat_name -> state of its current part
+        self.parts = {}  # chat_name -> number of parts opened so far
+
+    def _open(self, chat_name):
+        part = self.parts.get(chat_name, 0) + 1
+        self.parts[chat_name] = part
+        filename = os.path.join(self.directory,
+                                f'{chat_name}__{self.started}_{part:04d}.jsonl{EXTENSIONS[self.compression]}')
+        raw = open(filename, 'ab')
+        if self.compression == "gzip":
+            handle = gzip.GzipFile(fileobj=raw, mode='ab')
+        elif self.compression == "zstd":
+            handle = zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+        else:
+            handle = raw
+        state = {"raw": raw, "handle": handle, "filename": filename, "bytes": 0, "messages": 0}
+        self.files[chat_name] = state
+        return state
+
+    def write(self, chat_name, lines):
+        """Append serialized messages, one JSON document per line."""
+        state = self.files.get(chat_name) or self._open(chat_name)
+        data = "".join(f'{line}\n' for line in lines).encode('utf-8')
+        with metrics.WRITE_SECONDS.time(sink="jsonl"):
+            state["handle"].write(data)
+        metrics.BYTES.inc(len(data), sink="jsonl")
+        state["bytes"] += len(data)
+        state["messages"] += len(lines)
+
+        # Rotate; the next write opens the following part
+        if state["bytes"] >= self.max_bytes or (self.max_messages and state["messages"] >= self.max_messages):
+            self.close(chat_name)
+
+    def checkpoint(self, chat_name=None):
+        """Flush and fsync one channel's file, or all of them, so what was written survives a crash."""
+        names = [chat_name] if chat_name else list(self.files)
+        for name in names:
+            state = self.files.get(name)
+            if state is None:
+                continue
+            # Push buffered compressed data out as a complete block before syncing
+            if self.compression == "gzip":
+                state["handle"].flush(zlib.Z_SYNC_FLUSH)
+            elif self.compression == "zstd":
+                state["handle"].flush(zstandard.FLUSH_BLOCK)
+            state["raw"].flush()
+            os.fsync(state["raw"].fileno())
+
+    def close(self, chat_name=None):
+        """Fsync and close one channel's file, or all of them."""
+        names = [chat_name] if chat_name else list(self.files)
+        for name in names:
+            if name not in self.files:
+                continue
+            self.checkpoint(name)
+            state = self.files.pop(name)
+            if state["handle"] is not state["raw"]:
+                state["handle"].close()  # Writes the gzip trailer / zstd frame end
+            state["raw"].close()
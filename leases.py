@@ -0,0 +1,94 @@
+import asyncio
+import os
+import socket
+from datetime import datetime, timedelta, timezone
+from pymongo import ReturnDocument
+
+DEFAULT_TTL = 60  # Seconds a lease stays valid without a heartbeat
+MAX_FAILURES = 5  # Failed crawls after which an item is parked instead of being claimed again
+
+
+def worker_name():
+    """Owner name of this process, unique across the nodes sharing the database."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaseStore:
+    """Work items (channels) that worker processes claim through expiring leases in MongoDB.
+
+    A worker holds an item while it keeps renewing the lease with heartbeats. When a
+    worker dies its lease runs out after `ttl` seconds and another worker claims the
+    item; it resumes from the item's checkpoint, so no work is lost or done twice.
+    An item whose crawl failed `max_failures` times is marked done and failed, so a
+    broken channel is not retried forever.
+    """
+
+    def __init__(self, collection, owner=None, ttl=DEFAULT_TTL, max_failures=MAX_FAILURES):
+        self.collection = collection
+        self.owner = owner or worker_name()
+        self.ttl = ttl
+        self.max_failures = max_failures
+
+    def _expiry(self):
+        return datetime.now(timezone.utc) + timedelta(seconds=self.ttl)
+
+    def ensure(self, keys):
+        """Add the work items that do not exist yet; existing leases and progress are kept."""
+        for key in keys:
+            self.collection.update_one({"_id": key}, {"$setOnInsert": {"owner": None, "expires_at": None,
+                                                                       "done": False, "attempts": 0,
+                                                                       "failures": 0}},
+                                       upsert=True)
+
+    def claim(self):
+        """Take an unfinished item that is free or whose lease expired; None when nothing is left."""
+        now = datetime.now(timezone.utc)
+        # find_one_and_update is atomic, so two workers never win the same item
+        return self.collection.find_one_and_update(
+            {"done": False, "$or": [{"owner": None}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"owner": self.owner, "expires_at": self._expiry(), "claimed_at": now},
+             "$inc": {"attempts": 1}},
+            sort=[("expires_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def heartbeat(self, key):
+        """Extend our lease on `key`; False if it expired and another worker took it over."""
+        result = self.collection.update_one({"_id": key, "owner": self.owner},
+                                            {"$set": {"expires_at": self._expiry()}})
+        return result.matched_count == 1
+
+    def release(self, key, done=False):
+        """Give `key` back, marking it finished when `done`."""
+        self.collection.update_one({"_id": key, "owner": self.owner},
+                                   {"$set": {"owner": None, "expires_at": None, "done": done,
+                                             "released_at": datetime.now(timezone.utc)}})
+
+    def fail(self, key, error):
+        """Give `key` back after a failed crawl; returns True once it failed max_failures times and is parked."""
+        lease = self.collection.find_one_and_update(
+            {"_id": key, "owner": self.owner},
+            {"$set": {"owner": None, "expires_at": None, "last_error": repr(error),
+                      "released_at": datetime.now(timezone.utc)},
+             "$inc": {"failures": 1}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if lease is None or lease["failures"] < self.max_failures:
+            return False
+        self.collection.update_one({"_id": key, "owner": None}, {"$set": {"done": True, "failed": True}})
+        return True
+
+    def remaining(self):
+        return self.collection.count_documents({"done": False})
+
+    def failed(self):
+        return self.collection.count_documents({"failed": True})
+
+    async def keep_alive(self, key, lost, interval=None):
+        """Heartbeat `key` until cancelled; sets the asyncio.Event `lost` if the lease is taken over."""
+        interval = interval or self.ttl / 3
+        while True:
+            await asyncio.sleep(interval)
+            if not await asyncio.to_thread(self.heartbeat, key):
+                lost.set()
+                return
@@ -0,0 +1,173 @@
+import asyncio
+import hashlib
+import os
+import time
+import traceback
+from datetime import datetime, timezone
+from telethon import utils
+
+MAX_MEDIA_BYTES = 50 * 1024 * 1024  # Skip files larger than this
+MEDIA_TYPES = ("image/", "video/", "audio/", "application/pdf")  # MIME type prefixes worth keeping
+CHANNEL_QUOTA_BYTES = 5 * 1024 * 1024 * 1024  # Most bytes downloaded per channel in one run
+
+
+def media_reference(message):
+    """What the message carries as media, or None; web page previews, polls etc. are not files."""
+    if not (message.photo or message.document):
+        return None
+    file = message.file
+    return {
+        "channel_id": utils.get_peer_id(message.peer_id),
+        "message_id": message.id,
+        "kind": "photo" if message.photo else "document",
+        "file_id": (message.photo or message.document).id,  # Same for every forward of the file
+        "mime_type": file.mime_type or "",
+        "size": file.size or 0,
+        "ext": file.ext or "",
+        "name": file.name,
+    }
+
+
+def sha256_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaPipeline:
+    """Downloads message media on a pool of workers, storing every file once under its sha256.
+
+    `submit` never waits: a media reference that does not fit in the bounded queue,
+    or is over the size, type or per-channel byte quota, is skipped and counted.
+    Files go to `directory/ab/cd/<sha256><ext>`; the `collection` document of a file
+    (keyed by its hash) lists every message it appeared in, and the message document
+    gets the hash as `media_sha256`.
+    """
+
+    def __init__(self, collection, messages, directory, workers=4, queue_size=1000,
+                 max_bytes=MAX_MEDIA_BYTES, media_types=MEDIA_TYPES, channel_quota=CHANNEL_QUOTA_BYTES,
+                 rate_limiter=None):
+        self.collection = collection
+        self.messages = messages
+        self.directory = directory
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.max_bytes = max_bytes
+        self.media_types = media_types
+        self.channel_quota = channel_quota
+        self.rate_limiter = rate_limiter  # Paces the downloads under its "media" budget when given
+        self.reserved = {}  # channel_id -> bytes queued or downloaded this run
+        self.tasks = []
+        self.stats = {"downloaded": 0, "deduplicated": 0, "failed": 0, "dropped": 0,
+                      "too_large": 0, "wrong_type": 0, "over_quota": 0, "bytes": 0, "seconds": 0.0}
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    def submit(self, message):
+        """Queue the media of `message` if it passes the filters; never blocks the crawl."""
+        reference = media_reference(message)
+        if reference is None:
+            return
+        if reference["size"] > self.max_bytes:
+            self.stats["too_large"] += 1
+            return
+        if self.media_types and not reference["mime_type"].startswith(self.media_types):
+            self.stats["wrong_type"] += 1
+            return
+        channel_id = reference["channel_id"]
+        if self.reserved.get(channel_id, 0) + reference["size"] > self.channel_quota:
+            self.stats["over_quota"] += 1
+            return
+        try:
+            self.queue.put_nowait((message, reference))
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1  # The media stage is behind; the crawl does not wait for it
+            return
+        self.reserved[channel_id] = self.reserved.get(channel_id, 0) + reference["size"]
+
+    def submit_all(self, messages):
+        for message in messages:
+            self.submit(message)
+
+    async def _work(self):
+        while True:
+            message, reference = await self.queue.get()
+            try:
+                await self._download(message, reference)
+            except Exception:
+                self.stats["failed"] += 1
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
+
+    async def _download(self, message, reference):
+        # A forward reuses Telegram's file id, so most reposts are recognised without downloading.
+        # Mongo calls run on a thread like the hashing below, so the crawl never waits on them
+        known = await asyncio.to_thread(self.collection.find_one, {"file_ids": reference["file_id"]}, {"_id": 1})
+        if known:
+            self.stats["deduplicated"] += 1
+            await asyncio.to_thread(self._link, known["_id"], reference)
+            return
+
+        temporary = os.path.join(self.directory, f".{reference['channel_id']}_{reference['message_id']}.part")
+        path = None
+        try:
+            started = time.monotonic()
+            if self.rate_limiter:
+                path = await self.rate_limiter.call("media", message.download_media, file=temporary)
+            else:
+                path = await message.download_media(file=temporary)
+            if path is None:
+                return
+            self.stats["seconds"] += time.monotonic() - started
+            size = os.path.getsize(path)
+            self.stats["bytes"] += size
+
+            # Hashing a file of up to MAX_MEDIA_BYTES would stall the event loop, so it runs on a thread
+            sha256 = await asyncio.to_thread(sha256_file, path)
+            target_dir = os.path.join(self.directory, sha256[:2], sha256[2:4])
+            target = os.path.join(target_dir, sha256 + reference["ext"])
+            if os.path.exists(target):
+                os.remove(path)  # Same file reposted elsewhere: keep the copy we have
+                self.stats["deduplicated"] += 1
+            else:
+                os.makedirs(target_dir, exist_ok=True)
+                os.replace(path, target)
+                self.stats["downloaded"] += 1
+        finally:
+            # A failed or cancelled download or hash leaves its partial file behind otherwise
+            for leftover in (temporary, path):
+                if leftover and os.path.exists(leftover):
+                    os.remove(leftover)
+        await asyncio.to_thread(
+            self._link, sha256, reference,
+            {"path": os.path.relpath(target, self.directory), "size": size, "mime_type": reference["mime_type"],
+             "kind": reference["kind"], "name": reference["name"], "first_seen": datetime.now(timezone.utc)})
+
+    def _link(self, sha256, reference, details=None):
+        """Record that the message of `reference` carries the file `sha256`, on both documents."""
+        link = {"channel_id": reference["channel_id"], "id": reference["message_id"]}
+        update = {"$addToSet": {"messages": link, "file_ids": reference["file_id"]}}
+        if details:
+            update["$setOnInsert"] = details  # MongoDB before 5.0 rejects an empty operator
+        self.collection.update_one({"_id": sha256}, update, upsert=True)
+        self.messages.update_one(link, {"$set": {"media_sha256": sha256}})
+
+    async def close(self):
+        """Finish the queued downloads and stop the workers."""
+        await self.queue.join()
+        for task in self.tasks:
+            task.cancel()
+
+    def report(self):
+        stats = self.stats
+        rate = stats["bytes"] / stats["seconds"] / 1024 / 1024 if stats["seconds"] else 0
+        return (f"Media: {stats['downloaded']} downloaded, {stats['deduplicated']} duplicates, "
+                f"{stats['failed']} failed, {stats['dropped']} dropped (queue full), "
+                f"{stats['too_large']} too large, {stats['wrong_type']} skipped by type, "
+                f"{stats['over_quota']} over quota, {stats['bytes'] / 1024 / 1024:.1f} MB "
+                f"at {rate:.2f} MB/s per worker")
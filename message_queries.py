@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+# Sort order of time-range queries; the date_channel_message index serves both the range and the sort
+ORDER = [("date", 1), ("channel_id", 1), ("id", 1)]
+
+
+def find_messages(collection, start, end, channel_id=None, page_size=100, after=None, projection=None):
+    """One page of messages with start <= date < end, oldest first.
+
+    Returns (messages, cursor). Pass the cursor as `after` to get the next page; it is
+    None once there are no more pages. Paging continues from the last (date, channel_id, id)
+    seen instead of skipping, so every page is an index range scan.
+    """
+    query = {"date": {"$gte": start, "$lt": end}}
+    if channel_id is not None:
+        query["channel_id"] = channel_id
+    if after is not None:
+        date, last_channel_id, last_id = after
+        query["$or"] = [
+            {"date": {"$gt": date}},
+            {"date": date, "channel_id": {"$gt": last_channel_id}},
+            {"date": date, "channel_id": last_channel_id, "id": {"$gt": last_id}},
+        ]
+    messages = list(collection.find(query, projection).sort(ORDER).limit(page_size))
+    if len(messages) < page_size:
+        return messages, None
+    last = messages[-1]
+    return messages, (last["date"], last["channel_id"], last["id"])
+
+
+def iter_messages(collection, start, end, channel_id=None, page_size=1000, projection=None):
+    """Every message with start <= date < end, oldest first, fetched page by page."""
+    after = None
+    while True:
+        messages, after = find_messages(collection, start, end, channel_id, page_size, after, projection)
+        yield from messages
+        if after is None:
+            return
+
+
+def print_messages_for_date(collection, target_date, channel_id=None):
+    """Print the messages posted on one (UTC) day."""
+    start_of_day = datetime.combine(target_date, datetime.min.time())
+    end_of_day = start_of_day + timedelta(days=1)
+    projection = {"_id": 0, "from_id": 1, "text": 1, "date": 1, "channel_id": 1, "id": 1}
+    for message in iter_messages(collection, start_of_day, end_of_day, channel_id, projection=projection):
+        print(f"User: {message.get('from_id')}, Message: {message.get('text')}, Date: {message.get('date')}")
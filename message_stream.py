@@ -0,0 +1,73 @@
+import asyncio
+import resource
+import sys
+import metrics
+
+
+async def stream_pages(client, chat_info, rate_limiter, page_size, offset_id=0, min_id=0, prefetch=1,
+                       should_stop=lambda: False):
+    """Yield pages of a chat, newest first, without keeping earlier pages alive.
+
+    A background task fetches up to `prefetch` pages ahead of the consumer into a
+    bounded queue, so fetching overlaps with saving; when the consumer falls behind
+    the queue fills up and fetching pauses. Pages below `offset_id` and above
+    `min_id` are returned, like Telethon's get_messages.
+    """
+    queue = asyncio.Queue(maxsize=max(1, prefetch))
+
+    async def produce():
+        position = offset_id
+        try:
+            while not should_stop():
+                messages = await rate_limiter.call("history", client.get_messages, entity=chat_info,
+                                                   limit=page_size, offset_id=position, min_id=min_id)
+                if not messages:
+                    break  # Stop when no more messages are returned
+                metrics.MESSAGES.inc(len(messages))
+                position = messages[-1].id  # Use the last message ID to paginate
+                await queue.put(messages)  # Waits here while the consumer is behind
+        except Exception as error:
+            await queue.put(error)
+            return
+        await queue.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        producer.cancel()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def latency_percentiles(latencies):
+    """Count, mean, p50/p95/p99 and max of latencies in seconds, as a dict of milliseconds."""
+    if not latencies:
+        return {"count": 0}
+    ordered = sorted(latencies)
+
+    def percentile(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    return {"count": len(ordered), "mean_ms": sum(ordered) / len(ordered) * 1000, "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95), "p99_ms": percentile(0.99), "max_ms": ordered[-1] * 1000}
+
+
+def summarize_latencies(latencies):
+    """One-line mean/p50/p95/max summary of per-page latencies in seconds."""
+    if not latencies:
+        return "no pages"
+    stats = latency_percentiles(latencies)
+    return (f"{stats['count']} pages, mean {stats['mean_ms']:.0f} ms, p50 {stats['p50_ms']:.0f} ms, "
+            f"p95 {stats['p95_ms']:.0f} ms, max {stats['max_ms']:.0f} ms")
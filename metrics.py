@@ -0,0 +1,187 @@
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Channel the current task works on; crawl_channels sets it, and tasks started from there inherit it
+channel = contextvars.ContextVar("channel", default="")
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REGISTRY = []
+
+
+def _key(labels):
+    """Label tuple of a sample, with the current channel added unless given."""
+    if "channel" not in labels:
+        labels["channel"] = channel.get()
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = [(name, value) for name, value in key + tuple(extra) if value != ""]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """Monotonic count per label set."""
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        # Updated from the event loop, writer and sink threads, and read by the HTTP server thread
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = _key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.values.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self.snapshot():
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+    def summary(self):
+        totals = {}
+        for key, value in self.snapshot():
+            label = dict(key).get("channel") or "-"
+            totals[label] = totals.get(label, 0) + value
+        return totals
+
+
+class Histogram:
+    """Bucketed distribution of durations in seconds per label set.
+
+    observe() is a dict lookup and a bisect, cheap enough to call once per page.
+    """
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.values = {}  # label key -> [bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()  # See Counter
+        REGISTRY.append(self)
+
+    def observe(self, seconds, **labels):
+        key = _key(labels)
+        with self.lock:
+            value = self.values.get(key)
+            if value is None:
+                value = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            value[bisect_left(self.buckets, seconds)] += 1
+            value[-1] += seconds
+
+    def snapshot(self):
+        with self.lock:
+            return [(key, list(value)) for key, value in self.values.items()]
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, value in self.snapshot():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), value[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {value[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+    def summary(self):
+        totals = {}
+        for key, value in self.snapshot():
+            label = dict(key).get("channel") or "-"
+            count, total = totals.get(label, (0, 0.0))
+            totals[label] = (count + sum(value[:-1]), total + value[-1])
+        return {label: {"count": count, "seconds": round(total, 3)} for label, (count, total) in totals.items()}
+
+
+# The hot-path stages of a crawl
+FETCH_SECONDS = Histogram("telegram_request_seconds", "Time spent in Telegram API requests")
+THROTTLE_SECONDS = Histogram("throttle_wait_seconds", "Time spent waiting for the rate limiter")
+SERIALIZE_SECONDS = Histogram("serialize_seconds", "Time spent serializing one page of messages")
+WRITE_SECONDS = Histogram("write_seconds", "Time spent writing one batch to a sink")
+MESSAGES = Counter("messages_fetched_total", "Messages fetched from Telegram")
+BYTES = Counter("bytes_written_total", "Bytes (uncompressed) written to output files")
+FLOOD_WAITS = Counter("flood_waits_total", "FloodWaitErrors returned by Telegram")
+UPSERTS = Counter("mongo_upserts_total", "Message upserts by outcome")
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def summary():
+    """Per-metric, per-channel totals, for the structured log line."""
+    return {metric.name: metric.summary() for metric in REGISTRY if metric.values}
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes would otherwise flood the crawl output
+
+
+def port_from_env(variable="METRICS_PORT"):
+    """Metrics port from the environment, or None (metrics endpoint off) when it is not set."""
+    value = os.environ.get(variable)
+    return int(value) if value else None
+
+
+def start_http_server(port, host="127.0.0.1"):
+    """Serve /metrics on a background thread; returns the server so it can be shut down.
+
+    A port already in use (another crawler running) only costs the endpoint: a warning
+    is printed and None returned, and the crawl carries on.
+    """
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as error:
+        print(f"Warning: metrics endpoint not started on {host}:{port}: {error}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+async def log_summary(interval=60):
+    """Print a JSON summary line every `interval` seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        print(json.dumps({"metrics": summary(), "time": time.time()}))
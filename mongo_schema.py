@@ -0,0 +1,106 @@
+from datetime import datetime, timezone
+from pymongo import ASCENDING, MongoClient, UpdateOne
+from telethon import utils
+from telethon.tl.types import PeerChannel, PeerChat, PeerUser
+from rollups import ActivityRollups
+
+# Peer classes as they appear under '_' in Message.to_dict()
+PEER_TYPES = {"PeerChannel": PeerChannel, "PeerChat": PeerChat, "PeerUser": PeerUser}
+
+
+def peer_dict_to_id(peer):
+    """Turn a stored {'_': 'PeerChannel', 'channel_id': ...} dict into Telethon's marked peer id."""
+    peer_type = PEER_TYPES[peer["_"]]
+    fields = {key: value for key, value in peer.items() if key != "_"}
+    return utils.get_peer_id(peer_type(**fields))
+
+
+def migrate_channel_ids(collection, batch_size=1000):
+    """Give documents written before channel_id existed their channel id and drop duplicates."""
+    operations = []
+    for document in collection.find({"channel_id": {"$exists": False}}, {"peer_id": 1}):
+        if not isinstance(document.get("peer_id"), dict):
+            continue  # Nothing to derive the channel from
+        operations.append(UpdateOne({"_id": document["_id"]},
+                                    {"$set": {"channel_id": peer_dict_to_id(document["peer_id"])}}))
+        if len(operations) >= batch_size:
+            collection.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+
+    # Old insert_one runs could leave several copies of a message; keep one so the unique index builds
+    duplicates = collection.aggregate([
+        {"$group": {"_id": {"channel_id": "$channel_id", "id": "$id"},
+                    "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True)
+    for duplicate in duplicates:
+        collection.delete_many({"_id": {"$in": duplicate["ids"][1:]}})
+
+
+def migrate_string_dates(collection):
+    """Convert dates stored as "%Y_%m_%d_%H_%M_%S" strings into native BSON datetimes, server side."""
+    for field in ("date", "edit_date"):
+        result = collection.update_many(
+            {field: {"$type": "string"}},
+            [{"$set": {field: {"$dateFromString": {"dateString": f"${field}", "format": "%Y_%m_%d_%H_%M_%S",
+                                                   "timezone": "UTC"}}}}],
+        )
+        print(f"Converted {result.modified_count} string {field} values to datetimes.")
+
+
+def drop_index_if_exists(collection, name):
+    if name in collection.index_information():
+        collection.drop_index(name)
+
+
+def run_migration(db, name, migration):
+    """Run `migration` once per database, remembering it in the schema_migrations collection."""
+    if db['schema_migrations'].find_one({"_id": name}):
+        return
+    print(f"Running migration {name}...")
+    migration()
+    # Upsert, so two processes that started together both record it without a duplicate key error
+    db['schema_migrations'].update_one({"_id": name}, {"$set": {"applied_at": datetime.now(timezone.utc)}},
+                                       upsert=True)
+
+
+def ensure_indexes(db):
+    """Bootstrap the schema of the Telegram database; safe to call on every start."""
+    messages = db['messages']
+    run_migration(db, "channel_id", lambda: migrate_channel_ids(messages))
+    run_migration(db, "native_dates", lambda: migrate_string_dates(messages))
+    # Messages stored before the crawlers kept rollups are counted once, so the rollups cover all history
+    run_migration(db, "activity_rollups", lambda: ActivityRollups(db['activity_rollups']).rebuild(messages))
+
+    # Message ids are only unique within a channel, so the upsert key is (channel_id, id)
+    messages.create_index([("channel_id", ASCENDING), ("id", ASCENDING)], unique=True, name="channel_message")
+    # Date lookups across all channels, in the (date, channel_id, id) order message_queries pages by,
+    # so keyset pages are index range scans with no in-memory sort; it replaces the old date-only index
+    messages.create_index([("date", ASCENDING), ("channel_id", ASCENDING), ("id", ASCENDING)],
+                          name="date_channel_message")
+    run_migration(db, "drop_date_index", lambda: drop_index_if_exists(messages, "date"))
+    # Date lookups within one channel
+    messages.create_index([("channel_id", ASCENDING), ("date", ASCENDING)], name="channel_date")
+    # Incremental exports look for messages written or changed since the previous export
+    messages.create_index([("updated_at", ASCENDING)], name="updated_at")
+
+    # Daily/hourly activity rollups are read by unit and time range, optionally per channel
+    db['activity_rollups'].create_index([("unit", ASCENDING), ("channel_id", ASCENDING), ("start", ASCENDING)],
+                                        name="unit_channel_start")
+    db['activity_rollups'].create_index([("unit", ASCENDING), ("start", ASCENDING)], name="unit_start")
+
+    # Sharded backfills load the shard plan of one channel at a time
+    db['backfill_shards'].create_index([("channel_id", ASCENDING), ("hi", ASCENDING)], name="channel_hi")
+
+    # Workers look for unfinished channels whose lease is free or expired
+    db['channel_leases'].create_index([("done", ASCENDING), ("expires_at", ASCENDING)], name="done_expires")
+
+    # Downloaded media are looked up by Telegram file id before downloading again
+    db['media'].create_index([("file_ids", ASCENDING)], name="file_ids")
+
+
+if __name__ == "__main__":
+    # Run the migrations and build the indexes without starting a crawl
+    ensure_indexes(MongoClient('localhost', 27017)['Telegram'])
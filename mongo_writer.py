@@ -0,0 +1,100 @@
+from pymongo import UpdateOne
+import metrics
+
+
+def upsert_pipeline(document):
+    """Update pipeline that writes `document` and stamps updated_at with the server time if anything changed.
+
+    updated_at moves on insert and whenever a field differs from the stored one, and
+    only then, so re-crawling an unchanged message does not mark it for the exports.
+    $$NOW is taken when the write is applied, not when the page was queued. Values go
+    in as $literal, so strings starting with "$" are not read as field paths.
+    """
+    values = {field: {"$literal": value} for field, value in document.items()}
+    changed = {"$or": [{"$ne": [f"${field}", value]} for field, value in values.items()]}
+    return [
+        {"$set": {"updated_at": {"$cond": [changed, "$$NOW", "$updated_at"]}}},
+        {"$set": values},
+    ]
+
+
+class BulkMessageWriter:
+    """Collects message upserts and writes them as one unordered bulk_write per batch.
+
+    A batch is flushed every `batch_pages` pages; `write_concern` (a pymongo
+    WriteConcern) overrides the collection's default for these writes.
+    """
+
+    def __init__(self, collection, batch_pages=1, write_concern=None):
+        if write_concern is not None:
+            collection = collection.with_options(write_concern=write_concern)
+        self.collection = collection
+        self.batch_pages = batch_pages
+        self.pending = []  # UpdateOne operations not written yet
+        self.documents = []  # The documents behind self.pending, in the same order
+        self.pending_pages = 0
+        self.callbacks = []  # Run once the pending operations are written
+        self.insert_hooks = []  # Receive the documents each batch newly inserted
+        self.write_hooks = []  # Receive every document of each written batch
+        self.stats = {"inserted": 0, "updated": 0, "unchanged": 0}
+
+    def add(self, documents):
+        """Queue one page of serialized messages; returns the counts if this flushed a batch."""
+        for document in documents:
+            # Message ids are only unique within a channel, matching the channel_message index
+            key = {"channel_id": document["channel_id"], "id": document["id"]}
+            self.pending.append(UpdateOne(key, upsert_pipeline(document), upsert=True))
+            self.documents.append(document)
+        self.pending_pages += 1
+        if self.pending_pages >= self.batch_pages:
+            return self.flush()
+        return None
+
+    def on_insert(self, hook):
+        """Call hook(documents) with the documents of every batch that were inserted, not updated."""
+        self.insert_hooks.append(hook)
+
+    def on_write(self, hook):
+        """Call hook(documents) with every document of each batch once it is written, inserted or not."""
+        self.write_hooks.append(hook)
+
+    def after_flush(self, callback):
+        """Call `callback` once everything queued so far is written to MongoDB."""
+        if self.pending:
+            self.callbacks.append(callback)
+        else:
+            callback()
+
+    def flush(self):
+        """Write the pending upserts and return the inserted/updated/unchanged counts."""
+        operations, documents, callbacks = self.pending, self.documents, self.callbacks
+        self.pending, self.documents, self.callbacks, self.pending_pages = [], [], [], 0
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+        if operations:
+            # Unordered, so one failing document does not stop the rest of the batch
+            # Metrics are labelled with the channel whose page triggered the write
+            with metrics.WRITE_SECONDS.time(sink="mongo"):
+                result = self.collection.bulk_write(operations, ordered=False)
+            counts["inserted"] = result.upserted_count
+            counts["updated"] = result.modified_count
+            counts["unchanged"] = result.matched_count - result.modified_count
+            for key, value in counts.items():
+                self.stats[key] += value
+                metrics.UPSERTS.inc(value, outcome=key)
+
+            # upserted_ids maps the index of each operation that inserted to the new _id
+            if self.insert_hooks and result.upserted_ids:
+                inserted = [documents[index] for index in sorted(result.upserted_ids)]
+                for hook in self.insert_hooks:
+                    hook(inserted)
+            for hook in self.write_hooks:
+                hook(documents)
+
+        # Only reached when the write succeeded, so dropped callbacks are simply retried next run
+        for callback in callbacks:
+            callback()
+        return counts
+
+    def report(self):
+        stats = self.stats
+        return f"MongoDB: {stats['inserted']} inserted, {stats['updated']} updated, {stats['unchanged']} unchanged"
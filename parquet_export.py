@@ -0,0 +1,113 @@
+import json
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from pymongo import MongoClient, ReadPreference
+import columnar
+
+EXPORT_DIR = "parquet"
+MANIFEST = "_manifest.json"  # Leading underscore: dataset readers skip it
+CHUNK_ROWS = 50000  # Rows read from Mongo and written as one row group at a time
+# The next export rescans this far back from when the previous one started. That covers writes
+# not yet replicated to the secondary we read, and skew between our clock and the server's $$NOW
+WATERMARK_LAG = timedelta(minutes=10)
+
+
+def partition_path(channel_id, day):
+    # Hive-style keys; named apart from the channel_id and date columns so readers can merge both
+    return os.path.join(f"channel={channel_id}", f"day={day}", "part-0.parquet")
+
+
+def load_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {"watermark": None, "partitions": {}}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST)
+    temporary = os.path.join(directory, f'_{MANIFEST}.tmp')
+    with open(temporary, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(temporary, path)
+
+
+def changed_partitions(collection, watermark):
+    """(channel_id, "YYYY-MM-DD") pairs holding a message written or changed after `watermark`."""
+    match = {"date": {"$type": "date"}}
+    if watermark is not None:
+        match["updated_at"] = {"$gt": watermark}  # Served by the updated_at index
+    pipeline = [
+        {"$match": match},
+        {"$group": {"_id": {"channel_id": "$channel_id",
+                            "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$date"}}}}},
+    ]
+    return sorted((group["_id"]["channel_id"], group["_id"]["day"])
+                  for group in collection.aggregate(pipeline, allowDiskUse=True))
+
+
+def export_partition(collection, directory, channel_id, day, chunk_rows=CHUNK_ROWS):
+    """Rewrite one channel/day partition from Mongo, streaming it in chunks; returns its row count."""
+    start = datetime.strptime(day, "%Y-%m-%d")
+    # Messages reconcile.py found deleted on Telegram are left out, so the partition mirrors the channel
+    query = {"channel_id": channel_id, "date": {"$gte": start, "$lt": start + timedelta(days=1)},
+             "deleted": {"$ne": True}}
+    projection = {"_id": 0, **{name: 1 for name, _ in columnar.COLUMNS}}  # Only the exported columns leave Mongo
+    path = os.path.join(directory, partition_path(channel_id, day))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = os.path.join(os.path.dirname(path), '_part.tmp')
+
+    rows = 0
+    chunk = []
+    # Written next to the old file and swapped in, so readers never see a half-written partition
+    with columnar.pq.ParquetWriter(temporary, columnar.schema(), compression="zstd") as writer:
+        for document in collection.find(query, projection).sort("id", 1).batch_size(chunk_rows):
+            chunk.append(document)
+            if len(chunk) >= chunk_rows:
+                writer.write_table(columnar.to_table(chunk))
+                rows += len(chunk)
+                chunk = []
+        if chunk or not rows:
+            writer.write_table(columnar.to_table(chunk))
+            rows += len(chunk)
+    os.replace(temporary, path)
+    return rows
+
+
+def export(collection, directory=EXPORT_DIR, full=False):
+    """Export the messages collection as Parquet partitioned by channel and day.
+
+    Only partitions with messages written since the previous export (the manifest's
+    watermark on updated_at) are rewritten; `full` rewrites everything. Messages
+    stored before updated_at existed are only picked up by the first or a full export.
+    """
+    columnar.require_pyarrow()
+    # Read from a secondary when there is one, keeping the scan off the primary that ingest writes to
+    collection = collection.with_options(read_preference=ReadPreference.SECONDARY_PREFERRED)
+    os.makedirs(directory, exist_ok=True)
+    manifest = load_manifest(directory)
+    # Taken before reading and lagged, so anything written during or shortly before the export is
+    # picked up by the next one; rewriting a partition twice is harmless
+    started = datetime.now(timezone.utc)
+    watermark = None if full or not manifest["watermark"] else datetime.fromisoformat(manifest["watermark"])
+
+    partitions = changed_partitions(collection, watermark)
+    print(f"{len(partitions)} partitions to export")
+    for channel_id, day in partitions:
+        rows = export_partition(collection, directory, channel_id, day)
+        manifest["partitions"][f"{channel_id}/{day}"] = {
+            "path": partition_path(channel_id, day), "rows": rows, "exported_at": started.isoformat()}
+        print(f"Exported channel {channel_id} {day}: {rows} rows")
+
+    manifest["watermark"] = (started - WATERMARK_LAG).isoformat()
+    save_manifest(directory, manifest)
+    return partitions
+
+
+if __name__ == "__main__":
+    # python parquet_export.py [directory] [--full]
+    arguments = [argument for argument in sys.argv[1:] if argument != "--full"]
+    export(MongoClient('localhost', 27017)['Telegram']['messages'], arguments[0] if arguments else EXPORT_DIR,
+           full="--full" in sys.argv)
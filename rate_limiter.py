@@ -0,0 +1,114 @@
+import asyncio
+import time
+from telethon.errors import FloodWaitError
+import metrics
+
+
+class TokenBucket:
+    """Token bucket shared by every coroutine that talks to the Telegram API."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate  # Tokens added per second
+        self.capacity = max(1, capacity or rate)  # Maximum burst size
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0  # Set by pause() when the server asks us to wait
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + max(0, now - self.updated) * self.rate)
+        # updated stays at the end of a pause (see pause()) until the pause is over
+        self.updated = max(self.updated, now)
+
+    def set_rate(self, rate):
+        """Change the refill rate, keeping the tokens earned so far."""
+        self._refill()
+        self.rate = rate
+        self.capacity = max(1, rate)
+        self.tokens = min(self.tokens, self.capacity)
+
+    def pause(self, seconds):
+        """Hand out no tokens for the next `seconds` seconds."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        # Nothing may be earned while paused, so restart the refill clock at the end of the pause
+        self.tokens = 0
+        self.updated = self.paused_until
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        # The lock keeps waiters in FIFO order so no channel starves the others
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AdaptiveRateLimiter:
+    """Per request class token buckets that speed up on success and back off on FloodWaitError.
+
+    `budgets` maps a request class (e.g. "history", "get_entity") to the highest
+    rate in requests per second we allow ourselves for it. Every success raises the
+    rate additively towards that ceiling, and a FloodWaitError halves it and pauses
+    the class for exactly the number of seconds the server asked for.
+    """
+
+    def __init__(self, budgets, min_rate=0.1, increase=0.5, backoff=0.5, max_retries=5):
+        self.max_rates = dict(budgets)
+        self.buckets = {name: TokenBucket(rate) for name, rate in budgets.items()}
+        self.min_rate = min_rate
+        self.increase = increase  # Requests per second added after each success
+        self.backoff = backoff  # Factor applied to the rate after a FloodWaitError
+        self.max_retries = max_retries
+        self.stats = {name: {"requests": 0, "flood_waits": 0, "throttled": 0.0, "working": 0.0}
+                      for name in budgets}
+
+    async def call(self, request_class, func, *args, **kwargs):
+        """Await func(*args, **kwargs) within the budget of `request_class`, retrying FloodWaits."""
+        bucket = self.buckets[request_class]
+        stats = self.stats[request_class]
+
+        for attempt in range(self.max_retries + 1):
+            # Time spent waiting for a token counts as throttled
+            waiting_since = time.monotonic()
+            await bucket.acquire()
+            started = time.monotonic()
+            stats["throttled"] += started - waiting_since
+            metrics.THROTTLE_SECONDS.observe(started - waiting_since, request_class=request_class)
+
+            try:
+                result = await func(*args, **kwargs)
+            except FloodWaitError as error:
+                stats["working"] += time.monotonic() - started
+                stats["flood_waits"] += 1
+                metrics.FLOOD_WAITS.inc(request_class=request_class)
+                bucket.set_rate(max(self.min_rate, bucket.rate * self.backoff))
+                bucket.pause(error.seconds)
+                print(f"FloodWait on {request_class}: waiting {error.seconds}s, "
+                      f"rate lowered to {bucket.rate:.2f} req/s")
+                if attempt == self.max_retries:
+                    raise
+                continue
+
+            elapsed = time.monotonic() - started
+            stats["working"] += elapsed
+            stats["requests"] += 1
+            metrics.FETCH_SECONDS.observe(elapsed, request_class=request_class)
+            bucket.set_rate(min(self.max_rates[request_class], bucket.rate + self.increase))
+            return result
+
+    def report(self):
+        """Return requests, FloodWaits and throttled vs working time per class, summed over all callers."""
+        lines = []
+        for name, stats in self.stats.items():
+            lines.append(f"{name}: {stats['requests']} requests, {stats['flood_waits']} FloodWaits, "
+                         f"{stats['throttled']:.1f}s throttled, {stats['working']:.1f}s working, "
+                         f"current rate {self.buckets[name].rate:.2f} req/s")
+        return "\n".join(lines)
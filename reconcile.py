@@ -0,0 +1,181 @@
+import argparse
+import asyncio
+import signal
+from contextlib import aclosing
+from datetime import datetime, timedelta, timezone
+from telethon import TelegramClient, utils
+from pymongo import MongoClient, UpdateOne
+from config import Config
+from rate_limiter import AdaptiveRateLimiter
+from concurrent_crawl import crawl_channels
+from entity_cache import EntityCache, MongoEntityStore
+from message_stream import stream_pages
+from mongo_schema import ensure_indexes
+from search import SearchIndex
+from serializer import serialize
+from fake_telegram import FakeTelegramClient
+
+# Fields that change after a message is posted; an edit_date change also refreshes its other fields
+TRACKED_FIELDS = ("edit_date", "views", "forwards")
+
+
+def comparable(value):
+    """`value` as stored in Mongo: datetimes come back as naive UTC, also inside full-schema objects."""
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    if isinstance(value, dict):
+        return {key: comparable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [comparable(item) for item in value]
+    return value
+
+
+def changed_fields(fresh, stored):
+    """The fields of `fresh` that differ from `stored`: the tracked ones, or all of them once edit_date moved."""
+    edited = comparable(fresh.get("edit_date")) != comparable(stored.get("edit_date"))
+    fields = fresh if edited else TRACKED_FIELDS
+    return {field: fresh.get(field) for field in fields
+            if comparable(fresh.get(field)) != comparable(stored.get(field))}
+
+
+class Reconciler:
+    """Refreshes the recent window of stored channels: edits, view and forward counts, deletions.
+
+    Every page fetched newest first covers a contiguous id range of the channel, so
+    a stored message in that range the page did not return was deleted. Only changed
+    fields are written (plus updated_at), one unordered bulk_write per page; messages
+    not stored yet are left to the crawlers.
+    """
+
+    def __init__(self, collection, rate_limiter, entity_cache, days=None, messages=None, page_size=100,
+                 mode="lean", search_index=None, should_stop=lambda: False):
+        if days is None and messages is None:
+            raise ValueError("Give the window as days, messages or both")
+        self.collection = collection
+        self.rate_limiter = rate_limiter
+        self.entity_cache = entity_cache
+        self.days = days
+        self.messages = messages
+        self.page_size = page_size
+        self.mode = mode
+        self.search_index = search_index
+        self.should_stop = should_stop
+        self.stats = {"checked": 0, "updated": 0, "deleted": 0}
+
+    def _reconcile_page(self, channel_id, documents, low_id, high_id):
+        """Diff documents (ids in [low_id, high_id), high_id None for the newest page) against Mongo."""
+        id_range = {"$gte": low_id}
+        if high_id is not None:
+            id_range["$lt"] = high_id
+        projection = {"_id": 0, "id": 1, "deleted": 1, **{field: 1 for field in documents[0]}}
+        stored = {document["id"]: document
+                  for document in self.collection.find({"channel_id": channel_id, "id": id_range}, projection)}
+
+        operations = []
+        changed = []  # For the search index: edited documents and deleted stubs
+        for document in documents:
+            previous = stored.pop(document["id"], None)
+            if previous is None:
+                continue
+            changes = changed_fields(document, previous)
+            if changes:
+                # updated_at is the server's time of the write, like BulkMessageWriter's, for the export watermarks
+                operations.append(UpdateOne({"channel_id": channel_id, "id": document["id"]},
+                                            {"$set": changes, "$currentDate": {"updated_at": True}}))
+                if "text" in changes:
+                    changed.append(document)
+        missing = [message_id for message_id, previous in stored.items() if not previous.get("deleted")]
+        for message_id in missing:
+            operations.append(UpdateOne({"channel_id": channel_id, "id": message_id},
+                                        {"$set": {"deleted": True}, "$currentDate": {"updated_at": True}}))
+            changed.append({"channel_id": channel_id, "id": message_id, "deleted": True})
+
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        if self.search_index is not None and changed:
+            self.search_index.record(changed)
+        self.stats["checked"] += len(documents)
+        self.stats["updated"] += len(operations) - len(missing)
+        self.stats["deleted"] += len(missing)
+
+    async def fetch(self, client, chat_name):
+        """Reconcile one channel's window; the `fetch` callable of crawl_channels."""
+        cutoff = datetime.now(timezone.utc) - timedelta(days=self.days) if self.days is not None else None
+        count = 0
+        high_id = None
+        async with self.entity_cache.peer(client, chat_name, self.rate_limiter) as chat_info:
+            channel_id = utils.get_peer_id(chat_info)
+            pages = stream_pages(client, chat_info, self.rate_limiter, self.page_size, should_stop=self.should_stop)
+            async with aclosing(pages):
+                async for messages in pages:
+                    if cutoff is not None:
+                        messages = [message for message in messages if message.date >= cutoff]
+                    if self.messages is not None:
+                        messages = messages[:self.messages - count]
+                    if not messages:
+                        break
+                    documents = [serialize(message, self.mode) for message in messages]
+                    low_id = documents[-1]["id"]
+                    await asyncio.to_thread(self._reconcile_page, channel_id, documents, low_id, high_id)
+                    high_id = low_id
+                    count += len(messages)
+                    if self.messages is not None and count >= self.messages:
+                        break
+        print(f"[{chat_name}] Reconciled {count} messages")
+        return {"count": count, "channel": chat_info}
+
+    def report(self):
+        stats = self.stats
+        return f"Reconcile: {stats['checked']} checked, {stats['updated']} updated, {stats['deleted']} marked deleted"
+
+
+# Settings of the reconciliation run
+monitoring_channels = ["pal_Online9"]
+FAKE_CHANNELS = [f"fake_channel_{index}" for index in range(16)]
+WINDOW_DAYS = 3  # Default window: messages posted in the last WINDOW_DAYS days...
+WINDOW_MESSAGES = None  # ...and/or the newest WINDOW_MESSAGES messages of each channel
+RATE_LIMIT = 30
+ENTITY_RATE_LIMIT = 1
+MESSAGES_PER_REQUEST = 100
+CONCURRENCY = 8
+
+# Global flag to handle graceful shutdown
+stop_signal = False
+
+
+def handle_stop_signal(signum, frame):
+    global stop_signal
+    stop_signal = True
+    print("\nGraceful shutdown initiated...")
+
+
+async def main(args):
+    db = MongoClient('localhost', 27017)['Telegram_fake' if args.fake else 'Telegram']
+    ensure_indexes(db)
+    rate_limiter = AdaptiveRateLimiter({"history": RATE_LIMIT, "get_entity": ENTITY_RATE_LIMIT})
+    reconciler = Reconciler(db['messages'], rate_limiter,
+                            EntityCache(MongoEntityStore(db['entities']), Config['username']),
+                            days=args.days, messages=args.messages, page_size=MESSAGES_PER_REQUEST,
+                            search_index=None if args.fake else SearchIndex("search.sqlite3"),
+                            should_stop=lambda: stop_signal)
+    if args.fake:
+        client, channels = FakeTelegramClient(), FAKE_CHANNELS
+    else:
+        client = TelegramClient(Config['username'], Config['api_id'], Config['api_hash'], flood_sleep_threshold=0)
+        channels = monitoring_channels
+    async with client:
+        await crawl_channels(client, channels, reconciler.fetch, concurrency=CONCURRENCY)
+    print(rate_limiter.report())
+    print(reconciler.report())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh edits, views, forwards and deletions of recent messages")
+    parser.add_argument("--days", type=float, help=f"window in days (default {WINDOW_DAYS})")
+    parser.add_argument("--messages", type=int, help="window in newest messages per channel")
+    parser.add_argument("--fake", action="store_true", help="reconcile the fake channels in Telegram_fake")
+    args = parser.parse_args()
+    if args.days is None and args.messages is None:
+        args.days, args.messages = WINDOW_DAYS, WINDOW_MESSAGES
+    signal.signal(signal.SIGINT, handle_stop_signal)
+    asyncio.run(main(args))
@@ -0,0 +1,131 @@
+import hashlib
+import math
+import sys
+from datetime import datetime, timezone
+from pymongo import MongoClient, UpdateOne
+
+HLL_BITS = 10  # 2**10 registers per bucket, about 3% standard error on distinct posters
+UNITS = ("day", "hour")
+
+
+def hll_register(value, bits=HLL_BITS):
+    """HyperLogLog register index and rank for one value."""
+    hashed = int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+    index = hashed >> (64 - bits)
+    rest = hashed & ((1 << (64 - bits)) - 1)
+    return index, (64 - bits) - rest.bit_length() + 1
+
+
+def hll_merge(*sketches):
+    """Register-wise maximum of several sketches."""
+    merged = {}
+    for sketch in sketches:
+        for index, rank in sketch.items():
+            if rank > merged.get(index, 0):
+                merged[index] = rank
+    return merged
+
+
+def hll_estimate(sketch, bits=HLL_BITS):
+    """Approximate number of distinct values recorded in `sketch` ({str(index): rank})."""
+    m = 1 << bits
+    alpha = 0.7213 / (1 + 1.079 / m)
+    zeros = m - len(sketch)
+    raw = alpha * m * m / (zeros + sum(2.0 ** -rank for rank in sketch.values()))
+    if raw <= 2.5 * m and zeros:
+        return m * math.log(m / zeros)  # Small range correction
+    return raw
+
+
+def bucket_start(date, unit):
+    """Start of the UTC day or hour `date` falls in, as a naive UTC datetime like pymongo returns."""
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    if unit == "day":
+        return date.replace(hour=0, minute=0, second=0, microsecond=0)
+    return date.replace(minute=0, second=0, microsecond=0)
+
+
+class ActivityRollups:
+    """Per-channel daily and hourly message counts with a HyperLogLog sketch of the posters.
+
+    Only messages that were actually inserted are counted, so upserting a message
+    again never counts it twice. Sketches are merged with $max and stay bounded at
+    2**HLL_BITS registers per bucket however many posters there are.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def record(self, documents):
+        """Add newly inserted message documents to their day and hour buckets."""
+        buckets = {}
+        for document in documents:
+            date = document.get('date')
+            if not isinstance(date, datetime):
+                continue
+            poster = document.get('from_id')
+            for unit in UNITS:
+                start = bucket_start(date, unit)
+                key = (document['channel_id'], unit, start)
+                bucket = buckets.setdefault(key, {"messages": 0, "posters": {}})
+                bucket["messages"] += 1
+                if poster is not None:
+                    index, rank = hll_register(poster)
+                    if rank > bucket["posters"].get(index, 0):
+                        bucket["posters"][index] = rank
+
+        operations = []
+        for (channel_id, unit, start), bucket in buckets.items():
+            update = {"$inc": {"messages": bucket["messages"]},
+                      "$setOnInsert": {"channel_id": channel_id, "unit": unit, "start": start}}
+            if bucket["posters"]:
+                update["$max"] = {f"posters.{index}": rank for index, rank in bucket["posters"].items()}
+            operations.append(UpdateOne({"_id": f"{channel_id}:{unit}:{start:%Y%m%d%H}"}, update, upsert=True))
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+
+    def read(self, unit="day", channel_id=None, start=None, end=None):
+        """Rows of (bucket start, messages, approximate distinct posters), summed over channels."""
+        query = {"unit": unit}
+        if channel_id is not None:
+            query["channel_id"] = channel_id
+        if start or end:
+            query["start"] = {}
+            if start:
+                query["start"]["$gte"] = start
+            if end:
+                query["start"]["$lt"] = end
+
+        merged = {}
+        for bucket in self.collection.find(query, {"_id": 0, "start": 1, "messages": 1, "posters": 1}):
+            row = merged.setdefault(bucket["start"], {"messages": 0, "posters": {}})
+            row["messages"] += bucket["messages"]
+            row["posters"] = hll_merge(row["posters"], bucket.get("posters", {}))
+        return [(start, row["messages"], round(hll_estimate(row["posters"])))
+                for start, row in sorted(merged.items())]
+
+    def rebuild(self, messages, channel_id=None, chunk_size=10000):
+        """Recompute the rollups of one channel, or of all, from the raw messages collection."""
+        query = {} if channel_id is None else {"channel_id": channel_id}
+        self.collection.delete_many(query)
+        if channel_id is None:
+            query = {"channel_id": {"$exists": True}}  # Legacy documents migrate_channel_ids could not place
+        chunk = []
+        # Counts are added with $inc and sketches merged with $max, so chunks can be recorded one by one
+        for document in messages.find(query, {"_id": 0, "channel_id": 1, "date": 1, "from_id": 1}):
+            chunk.append(document)
+            if len(chunk) >= chunk_size:
+                self.record(chunk)
+                chunk = []
+        self.record(chunk)
+
+
+if __name__ == "__main__":
+    # python rollups.py rebuild [channel_id]
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        sys.exit("usage: python rollups.py rebuild [channel_id]")
+    db = MongoClient('localhost', 27017)['Telegram']
+    rollups = ActivityRollups(db['activity_rollups'])
+    rollups.rebuild(db['messages'], int(sys.argv[2]) if len(sys.argv) > 2 else None)
+    print("Rollups rebuilt.")
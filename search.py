@@ -0,0 +1,196 @@
+import re
+import sqlite3
+import sys
+import threading
+import unicodedata
+from datetime import datetime, timedelta, timezone
+from pymongo import MongoClient
+
+SEARCH_DB = "search.sqlite3"
+SYNC_BATCH = 5000  # Documents indexed per transaction by sync()
+# The next sync rescans this far back from when the previous one started (replication lag, clock skew)
+WATERMARK_LAG = timedelta(minutes=10)
+
+# Arabic harakat, superscript alef, Quranic annotation marks and tatweel carry no meaning for search
+ARABIC_MARKS = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+# Letters written interchangeably in practice, folded to one form
+ARABIC_FOLDS = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",  # Hamza/madda/wasla alef -> alef
+    "ى": "ي", "ی": "ي", "ئ": "ي",  # Alef maksura, Farsi yeh, yeh with hamza -> yeh
+    "ة": "ه",  # Teh marbuta -> heh
+    "ؤ": "و",  # Waw with hamza -> waw
+    "ک": "ك",  # Keheh -> kaf
+})
+# Definite article, alone or after wa/fa/bi/ka/li, as attached to the front of a word of 2+ more letters
+ARABIC_ARTICLE = re.compile(r"(?<!\w)[وف]?(?:[بكل]?ال|لل)(?=\w\w)")
+TOKEN = re.compile(r"\w+", re.UNICODE)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    rowid INTEGER PRIMARY KEY,
+    channel_id INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    date INTEGER,
+    text TEXT NOT NULL,
+    UNIQUE (channel_id, id)
+);
+CREATE INDEX IF NOT EXISTS messages_channel_date ON messages (channel_id, date);
+CREATE INDEX IF NOT EXISTS messages_date ON messages (date);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (text, tokenize = 'unicode61 remove_diacritics 2');
+CREATE TRIGGER IF NOT EXISTS messages_indexed AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, text) VALUES (new.rowid, normalize(new.text));
+END;
+CREATE TRIGGER IF NOT EXISTS messages_reindexed AFTER UPDATE OF text ON messages BEGIN
+    DELETE FROM messages_fts WHERE rowid = old.rowid;
+    INSERT INTO messages_fts (rowid, text) VALUES (new.rowid, normalize(new.text));
+END;
+CREATE TRIGGER IF NOT EXISTS messages_removed AFTER DELETE ON messages BEGIN
+    DELETE FROM messages_fts WHERE rowid = old.rowid;
+END;
+CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def normalize(text):
+    """Search form of `text`: NFKC, case folded, Arabic marks and tatweel removed, letter variants unified.
+
+    The definite article is stripped too, so "المدرسة" and "مدرسة" index the same word.
+    """
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return ARABIC_ARTICLE.sub("", ARABIC_MARKS.sub("", text).translate(ARABIC_FOLDS))
+
+
+def match_expression(query):
+    """FTS5 MATCH expression for free text: every normalized word must occur, in any order.
+
+    Words are quoted, so punctuation and FTS operators in user input are taken literally.
+    """
+    return " ".join(f'"{token}"' for token in TOKEN.findall(normalize(query)))
+
+
+def message_text(document):
+    """Text of a lean ("text") or full Telethon to_dict ("message") document."""
+    text = document.get("text")
+    return text if text is not None else document.get("message")
+
+
+def timestamp(date):
+    if date is None:
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)  # pymongo returns naive UTC datetimes
+    return int(date.timestamp())
+
+
+class SearchIndex:
+    """Full-text index of message text in a SQLite FTS5 sidecar, ranked with bm25.
+
+    record() is meant as a BulkMessageWriter.on_write hook: a message is only
+    re-tokenized when its text changed, so feeding it every written batch is cheap.
+    The FTS table holds the normalized text and the messages table the original.
+    """
+
+    def __init__(self, path=SEARCH_DB):
+        # Hooks run on the Mongo writer thread while queries may come from elsewhere
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.create_function("normalize", 1, normalize, deterministic=True)
+        self.connection.execute("PRAGMA journal_mode = WAL")  # Readers never wait for the indexer
+        self.connection.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+    def record(self, documents):
+        """Index (or re-index edited) message documents of either schema.
+
+        Documents marked deleted (see reconcile.py) or without text, e.g. edited to
+        empty, are removed from the index.
+        """
+        rows = [(document["channel_id"], document["id"], timestamp(document.get("date")), message_text(document))
+                for document in documents if message_text(document) and not document.get("deleted")]
+        removed = [(document["channel_id"], document["id"]) for document in documents
+                   if document.get("deleted") or not message_text(document)]
+        if not rows and not removed:
+            return
+        with self.lock, self.connection:
+            self.connection.executemany("DELETE FROM messages WHERE channel_id = ? AND id = ?", removed)
+            self.connection.executemany(
+                "INSERT INTO messages (channel_id, id, date, text) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (channel_id, id) DO UPDATE SET text = excluded.text, date = excluded.date "
+                "WHERE text IS NOT excluded.text", rows)
+
+    def search(self, query, channel_id=None, start=None, end=None, limit=20, offset=0):
+        """Messages matching every word of `query`, best bm25 score first.
+
+        Optionally restricted to one channel and to start <= date < end; `limit` and
+        `offset` page through the ranked results. Returns a list of dicts with
+        channel_id, id, date (UTC datetime), text and score (lower is better).
+        """
+        expression = match_expression(query)
+        if not expression:
+            return []
+        sql = ("SELECT m.channel_id, m.id, m.date, m.text, bm25(messages_fts) AS score "
+               "FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid WHERE messages_fts MATCH ?")
+        parameters = [expression]
+        if channel_id is not None:
+            sql += " AND m.channel_id = ?"
+            parameters.append(channel_id)
+        if start is not None:
+            sql += " AND m.date >= ?"
+            parameters.append(timestamp(start))
+        if end is not None:
+            sql += " AND m.date < ?"
+            parameters.append(timestamp(end))
+        sql += " ORDER BY score LIMIT ? OFFSET ?"
+        parameters += [limit, offset]
+        with self.lock:
+            rows = self.connection.execute(sql, parameters).fetchall()
+        return [{"channel_id": channel_id, "id": message_id,
+                 "date": datetime.fromtimestamp(date, timezone.utc) if date is not None else None,
+                 "text": text, "score": score}
+                for channel_id, message_id, date, text, score in rows]
+
+    def sync(self, collection, full=False):
+        """Index what was written to Mongo since the last sync (by updated_at), e.g. by crawlers without the hook.
+
+        Returns the number of documents read.
+        """
+        # Messages without text are read too: one edited to empty text must leave the index
+        query = {}
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM sync_state WHERE key = 'watermark'").fetchone()
+        if row and not full:
+            query["updated_at"] = {"$gt": datetime.fromisoformat(row[0])}
+        # Taken first and lagged, so writes during or shortly before the sync are caught next time
+        started = datetime.now(timezone.utc)
+        projection = {"_id": 0, "channel_id": 1, "id": 1, "date": 1, "text": 1, "message": 1, "deleted": 1}
+        count = 0
+        batch = []
+        for document in collection.find(query, projection).batch_size(SYNC_BATCH):
+            batch.append(document)
+            if len(batch) >= SYNC_BATCH:
+                self.record(batch)
+                count += len(batch)
+                batch = []
+        self.record(batch)
+        count += len(batch)
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES ('watermark', ?)",
+                                    ((started - WATERMARK_LAG).isoformat(),))
+        return count
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    # python search.py sync [--full]
+    # python search.py "query words" [channel_id] [page]
+    index = SearchIndex(SEARCH_DB)
+    if sys.argv[1:2] == ["sync"]:
+        collection = MongoClient('localhost', 27017)['Telegram']['messages']
+        print(f"Indexed {index.sync(collection, full='--full' in sys.argv)} messages")
+    else:
+        channel_id = int(sys.argv[2]) if len(sys.argv) > 2 else None
+        page = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+        for result in index.search(sys.argv[1], channel_id, limit=20, offset=20 * page):
+            print(f"[{result['date']}] {result['channel_id']}/{result['id']} ({result['score']:.2f}): {result['text']}")
+    index.close()
@@ -0,0 +1,108 @@
+import base64
+import json
+import random
+import time
+from datetime import datetime
+from telethon import utils
+
+try:
+    import orjson  # Faster JSON backend when installed
+except ImportError:
+    orjson = None
+
+DATE_FORMAT = "%Y_%m_%d_%H_%M_%S"
+MODES = ("lean", "full")
+
+
+def peer_id_or_none(peer):
+    return utils.get_peer_id(peer) if peer else None
+
+
+def project_message(message):
+    """Flat document with only the fields the readers use."""
+    reply_to = message.reply_to
+    fwd_from = message.fwd_from
+    return {
+        "id": message.id,
+        "channel_id": utils.get_peer_id(message.peer_id),
+        "from_id": peer_id_or_none(message.from_id),
+        "date": message.date,
+        "edit_date": message.edit_date,
+        "text": message.message,
+        "views": message.views,
+        "forwards": message.forwards,
+        # Story replies have no reply_to_msg_id
+        "reply_to_msg_id": getattr(reply_to, "reply_to_msg_id", None),
+        "fwd_from_id": peer_id_or_none(fwd_from.from_id) if fwd_from else None,
+        "fwd_from_msg_id": fwd_from.channel_post if fwd_from else None,
+        "fwd_from_date": fwd_from.date if fwd_from else None,
+    }
+
+
+def full_message(message):
+    """Telethon's complete to_dict() output, without media, plus channel_id."""
+    msg_dict = message.to_dict()
+    msg_dict.pop('media', None)  # Exclude media to keep it simple
+    msg_dict['channel_id'] = utils.get_peer_id(message.peer_id)
+    return msg_dict
+
+
+def serialize(message, mode="lean"):
+    """Message document in the "lean" projected schema or the opt-in "full" to_dict schema."""
+    if mode == "lean":
+        return project_message(message)
+    if mode == "full":
+        return full_message(message)
+    raise ValueError(f"Unknown serialization mode {mode!r}, use one of {MODES}")
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.strftime(DATE_FORMAT)
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('ascii')
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def dumps(document):
+    """JSON line for a document, through orjson when it is installed."""
+    if orjson is not None:
+        # Passthrough so dates use DATE_FORMAT with both backends
+        return orjson.dumps(document, default=_json_default, option=orjson.OPT_PASSTHROUGH_DATETIME).decode('utf-8')
+    return json.dumps(document, default=_json_default, ensure_ascii=False)
+
+
+def legacy_serialize_message(message):
+    """The serializer the crawlers used before, kept as the benchmark baseline."""
+    msg_dict = message.to_dict()
+    if isinstance(msg_dict.get('date'), datetime):
+        msg_dict['date'] = msg_dict['date'].strftime(DATE_FORMAT)
+    if isinstance(msg_dict.get('edit_date'), datetime):
+        msg_dict['edit_date'] = msg_dict['edit_date'].strftime(DATE_FORMAT)
+    if 'media' in msg_dict:
+        del msg_dict['media']
+    # default=str: the original raised TypeError on nested dates such as fwd_from.date
+    return json.dumps(msg_dict, default=str)
+
+
+def benchmark(count=20000):
+    """Compare bytes per message and messages per second of the serializers."""
+    from synthetic_messages import make_message
+
+    rng = random.Random(42)
+    messages = [make_message(message_id, rng=rng) for message_id in range(1, count + 1)]
+    candidates = {
+        "legacy serialize_message": legacy_serialize_message,
+        "full + dumps": lambda message: dumps(serialize(message, "full")),
+        "lean + dumps": lambda message: dumps(serialize(message, "lean")),
+    }
+    print(f"{count} messages, JSON backend: {'orjson' if orjson else 'json'}")
+    for name, serializer in candidates.items():
+        started = time.perf_counter()
+        total_bytes = sum(len(serializer(message).encode('utf-8')) for message in messages)
+        elapsed = time.perf_counter() - started
+        print(f"{name:26} {total_bytes / count:8.0f} bytes/msg {count / elapsed:10.0f} msgs/s")
+
+
+if __name__ == "__main__":
+    benchmark()
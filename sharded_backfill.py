@@ -0,0 +1,188 @@
+import asyncio
+import sys
+import traceback
+from contextlib import aclosing
+from datetime import datetime, timezone
+from functools import partial
+from telethon import TelegramClient, utils
+from pymongo import MongoClient
+from config import Config
+from rate_limiter import AdaptiveRateLimiter
+from entity_cache import EntityCache, MongoEntityStore
+from checkpoints import CheckpointStore
+from message_stream import stream_pages, peak_rss_mb
+from mongo_writer import BulkMessageWriter
+from mongo_schema import ensure_indexes
+from rollups import ActivityRollups
+from serializer import serialize
+
+
+def plan_shards(top_id, shards):
+    """Split the message ids [1, top_id] into `shards` contiguous (lo, hi) ranges, newest first."""
+    shards = max(1, min(shards, top_id))
+    size = -(-top_id // shards)  # Ceiling division, so the last shard is the short one
+    ranges = [(lo, min(lo + size - 1, top_id)) for lo in range(1, top_id + 1, size)]
+    return ranges[::-1]
+
+
+class ShardStore:
+    """Per-shard backfill progress of a channel, one document per message-id range.
+
+    `position` is the offset_id the shard resumes from: every message of the shard
+    with an id at or above it is already written. A failed shard keeps its position
+    and error, so it can be retried on its own without touching the other shards.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def load(self, channel_id):
+        return list(self.collection.find({"channel_id": channel_id}).sort("hi", -1))
+
+    def create(self, channel_id, chat_name, top_id, ranges):
+        """Store the shard plan of a channel; an existing plan is kept so reruns resume it."""
+        existing = self.load(channel_id)
+        if existing:
+            return existing
+        self.collection.insert_many([
+            {"_id": f"{channel_id}:{lo}-{hi}", "channel_id": channel_id, "chat_name": chat_name,
+             "top_id": top_id, "lo": lo, "hi": hi, "position": hi + 1, "done": False}
+            for lo, hi in ranges
+        ])
+        return self.load(channel_id)
+
+    def advance(self, shard_id, position):
+        """Move a shard down to `position`; it only ever decreases."""
+        self.collection.update_one({"_id": shard_id}, {"$min": {"position": position},
+                                                       "$set": {"updated_at": datetime.now(timezone.utc)}})
+
+    def finish(self, shard_id):
+        self.collection.update_one({"_id": shard_id}, {"$set": {"done": True, "error": None,
+                                                                "updated_at": datetime.now(timezone.utc)}})
+
+    def fail(self, shard_id, error):
+        self.collection.update_one({"_id": shard_id}, {"$set": {"error": repr(error),
+                                                                "updated_at": datetime.now(timezone.utc)}})
+
+
+async def fetch_shard(session, shard, shards, writer, page_size, should_stop, prefetch=1):
+    """Page through one shard, newest first, moving its checkpoint after each durable page."""
+    client, rate_limiter, chat_info = session
+    count = 0
+    # offset_id excludes ids >= position and min_id excludes ids <= lo - 1, so only the shard comes back
+    pages = stream_pages(client, chat_info, rate_limiter, page_size, offset_id=shard["position"],
+                         min_id=shard["lo"] - 1, prefetch=prefetch, should_stop=should_stop)
+    async with aclosing(pages):
+        async for messages in pages:
+            count += len(messages)
+            writer.add([serialize(message) for message in messages])
+            writer.after_flush(partial(shards.advance, shard["_id"], messages[-1].id))
+    if not should_stop():
+        writer.after_flush(partial(shards.finish, shard["_id"]))
+    return count
+
+
+async def backfill_channel(sessions, chat_name, shards, checkpoints, writer, shard_count=8, page_size=100,
+                           per_session=2, should_stop=lambda: False, prefetch=1):
+    """Backfill one channel as `shard_count` message-id ranges fetched concurrently.
+
+    `sessions` is a list of (client, rate_limiter, entity_cache); each session resolves
+    the channel with its own access hash and works on up to `per_session` shards at
+    once within its own rate budget. Only unfinished shards are fetched, so rerunning
+    after a failure retries just those.
+    """
+    resolved = []
+    for client, rate_limiter, entity_cache in sessions:
+        chat_info = await entity_cache.resolve(client, chat_name, rate_limiter)
+        resolved.append((client, rate_limiter, chat_info))
+    client, rate_limiter, chat_info = resolved[0]
+    channel_id = utils.get_peer_id(chat_info)
+
+    # The plan is fixed when the backfill starts; newer messages are left to the incremental crawl
+    plan = shards.load(channel_id)
+    if not plan:
+        newest = await rate_limiter.call("history", client.get_messages, chat_info, limit=1)
+        if not newest:
+            print(f"{chat_name} has no messages")
+            return 0
+        top_id = newest[0].id
+        plan = shards.create(channel_id, chat_name, top_id, plan_shards(top_id, shard_count))
+    top_id = plan[0]["top_id"]
+
+    pending = asyncio.Queue()
+    for shard in plan:
+        if not shard["done"]:
+            pending.put_nowait(shard)
+    print(f"{chat_name}: {pending.qsize()}/{len(plan)} shards left below message {top_id}")
+    counts = {}
+
+    async def worker(session):
+        while not should_stop():
+            try:
+                shard = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                counts[shard["_id"]] = await fetch_shard(session, shard, shards, writer, page_size,
+                                                         should_stop, prefetch)
+                print(f"[{chat_name}] shard {shard['lo']}-{shard['hi']}: {counts[shard['_id']]} messages")
+            except Exception as error:
+                # One broken shard must not stop the others; its checkpoint says where to retry
+                traceback.print_exc()
+                writer.flush()
+                shards.fail(shard["_id"], error)
+
+    await asyncio.gather(*(worker(session) for session in resolved for _ in range(per_session)))
+    writer.flush()
+
+    if all(shard["done"] for shard in shards.load(channel_id)):
+        checkpoints.update(channel_id, chat_name, newest_id=top_id, oldest_id=1, backfill_done=True)
+        print(f"Backfill of {chat_name} complete")
+    return sum(counts.values())
+
+
+# Settings of the standalone backfill
+SHARDS = 16  # Message-id ranges the channel is split into
+SHARDS_PER_SESSION = 4  # Shards each session fetches at the same time
+MESSAGES_PER_REQUEST = 100
+RATE_LIMIT = 30  # history requests per second, per session
+ENTITY_RATE_LIMIT = 1
+
+
+async def main(chat_name, shard_count):
+    db = MongoClient('localhost', 27017)['Telegram']
+    ensure_indexes(db)
+    writer = BulkMessageWriter(db['messages'])
+    writer.on_insert(ActivityRollups(db['activity_rollups']).record)
+    shards = ShardStore(db['backfill_shards'])
+    checkpoints = CheckpointStore(db['checkpoints'])
+
+    # Several accounts can share the work: Config['accounts'] is a list of credential dicts
+    accounts = Config.get('accounts', [Config])
+    clients = [TelegramClient(account['username'], account['api_id'], account['api_hash'], flood_sleep_threshold=0)
+               for account in accounts]
+    sessions = []
+    for client, account in zip(clients, accounts):
+        await client.start()
+        sessions.append((client,
+                         AdaptiveRateLimiter({"history": RATE_LIMIT, "get_entity": ENTITY_RATE_LIMIT}),
+                         EntityCache(MongoEntityStore(db['entities']), account['username'])))
+    try:
+        total = await backfill_channel(sessions, chat_name, shards, checkpoints, writer, shard_count,
+                                       MESSAGES_PER_REQUEST, per_session=SHARDS_PER_SESSION)
+    finally:
+        for client in clients:
+            await client.disconnect()
+
+    print(f"Total messages retrieved: {total} from {chat_name}")
+    for (client, rate_limiter, _), account in zip(sessions, accounts):
+        print(f"{account['username']}: {rate_limiter.report()}")
+    print(writer.report())
+    print(f"Peak RSS: {peak_rss_mb():.1f} MB")
+
+
+if __name__ == "__main__":
+    # python sharded_backfill.py <channel> [shards]
+    if len(sys.argv) < 2:
+        sys.exit("usage: python sharded_backfill.py <channel> [shards]")
+    asyncio.run(main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else SHARDS))
@@ -0,0 +1,221 @@
+import asyncio
+import os
+from abc import ABC, abstractmethod
+import time
+import traceback
+import columnar
+import metrics
+from serializer import serialize, dumps
+
+
+class Sink(ABC):
+    """One output of the crawl engine, fed through its own bounded queue of pages.
+
+    A consumer task takes up to `batch_pages` queued pages at a time and writes them
+    with write_batch() on a worker thread, so blocking I/O never holds up the event
+    loop. With overflow="block" a full queue makes the fetch loop wait (backpressure);
+    with overflow="drop" the page is dropped for this sink instead (and the crawl engine
+    stops moving that channel's checkpoint for the run). A batch that still
+    fails after `max_retries` retries marks the sink failed: it drops everything after
+    that, and the other sinks carry on. Sinks whose writes are not `idempotent` (appends)
+    are written and retried a channel at a time, so a retry never repeats the pages of
+    the channels already written.
+    """
+
+    name = "sink"
+    idempotent = True  # Writing the same pages twice leaves the same output (e.g. upserts)
+
+    def __init__(self, queue_pages=16, batch_pages=4, overflow="block", max_retries=3, retry_delay=1.0):
+        if overflow not in ("block", "drop"):
+            raise ValueError(f"Unknown overflow policy {overflow!r}, use 'block' or 'drop'")
+        self.queue = asyncio.Queue(maxsize=queue_pages)
+        self.batch_pages = batch_pages
+        self.overflow = overflow
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.error = None
+        self.task = None
+        self.stats = {"pages": 0, "messages": 0, "dropped": 0, "batches": 0, "seconds": 0.0}
+
+    def start(self):
+        self.task = asyncio.create_task(self._consume())
+
+    async def submit(self, chat_name, messages):
+        """Queue one page; returns a future that is done once the page is written (or failed)."""
+        written = asyncio.get_running_loop().create_future()
+        if self.error is not None:
+            self._drop(written)
+        elif self.overflow == "drop" and self.queue.full():
+            self._drop(written)
+        else:
+            await self.queue.put((chat_name, messages, written))
+        return written
+
+    def _drop(self, written):
+        self.stats["dropped"] += 1
+        written.set_exception(self.error or RuntimeError(f"{self.name} sink queue full, page dropped"))
+        written.exception()  # Mark it retrieved; the engine only looks at it for the checkpoint
+
+    async def _consume(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_pages and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            pages = [(chat_name, messages) for chat_name, messages, _ in batch]
+            try:
+                if self.error is not None:
+                    raise self.error
+                await self._write_with_retries(pages)
+            except Exception as error:
+                self.error = self.error or error
+                for _, _, written in batch:
+                    self._drop(written)
+            else:
+                for chat_name, messages, written in batch:
+                    self.stats["pages"] += 1
+                    self.stats["messages"] += len(messages)
+                    written.set_result(None)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _write_with_retries(self, pages):
+        if self.idempotent:
+            parts = [pages]
+        else:
+            channels = {}
+            for chat_name, messages in pages:
+                channels.setdefault(chat_name, []).append((chat_name, messages))
+            parts = list(channels.values())
+        started = time.perf_counter()
+        for part in parts:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    await asyncio.to_thread(self.write_batch, part)
+                except Exception:
+                    traceback.print_exc()
+                    if attempt == self.max_retries:
+                        print(f"{self.name} sink failed; its pages are dropped from now on")
+                        raise
+                    await asyncio.sleep(self.retry_delay * 2 ** attempt)
+                    continue
+                break
+        elapsed = time.perf_counter() - started
+        self.stats["batches"] += 1
+        self.stats["seconds"] += elapsed
+        metrics.WRITE_SECONDS.observe(elapsed, sink=self.name)
+
+    @abstractmethod
+    def write_batch(self, pages):
+        """Write [(chat_name, messages), ...]; runs on a worker thread."""
+
+    def finish(self):
+        """Release files or connections once everything is written; runs on a worker thread."""
+
+    async def close(self):
+        """Write what is still queued, then finish."""
+        await self.queue.join()
+        if self.task:
+            self.task.cancel()
+        await asyncio.to_thread(self.finish)
+
+    def report(self):
+        stats = self.stats
+        status = f"failed ({self.error!r})" if self.error else "ok"
+        return (f"{self.name}: {stats['messages']} messages in {stats['pages']} pages, {stats['batches']} batches "
+                f"in {stats['seconds']:.1f}s, {stats['dropped']} pages dropped, {status}")
+
+
+class JsonlFileSink(Sink):
+    """JSONL archive, one file per channel (see jsonl_sink.JsonlSink), fsynced after every batch."""
+
+    name = "jsonl"
+    idempotent = False  # Appends
+
+    def __init__(self, jsonl_sink, mode="lean", **kwargs):
+        super().__init__(**kwargs)
+        self.jsonl_sink = jsonl_sink
+        self.mode = mode
+
+    def write_batch(self, pages):
+        written = set()
+        for chat_name, messages in pages:
+            with metrics.SERIALIZE_SECONDS.time(channel=chat_name):
+                lines = [dumps(serialize(message, self.mode)) for message in messages]
+            self.jsonl_sink.write(chat_name, lines)
+            written.add(chat_name)
+        for chat_name in written:
+            self.jsonl_sink.checkpoint(chat_name)
+
+    def finish(self):
+        self.jsonl_sink.close()
+
+
+class MongoSink(Sink):
+    """MongoDB messages collection through a BulkMessageWriter, one bulk_write per batch.
+
+    The writer's insert hooks (rollups) and after_flush callbacks run on the sink's thread.
+    """
+
+    name = "mongo"
+
+    def __init__(self, writer, mode="lean", **kwargs):
+        super().__init__(**kwargs)
+        self.writer = writer
+        self.mode = mode
+
+    def write_batch(self, pages):
+        documents = []
+        for chat_name, messages in pages:
+            with metrics.SERIALIZE_SECONDS.time(channel=chat_name):
+                documents.extend(serialize(message, self.mode) for message in messages)
+        # Added as one page, so the whole batch goes out in one bulk_write
+        self.writer.add(documents)
+        self.writer.flush()
+
+
+class ParquetSink(Sink):
+    """Columnar archive: one Parquet file per channel and run part, a row group per batch.
+
+    Parquet writes its footer on close, so a part is only readable once the sink is
+    closed or the part rotated after `max_rows` rows.
+    """
+
+    name = "parquet"
+    idempotent = False  # Appends row groups
+
+    def __init__(self, directory=".", max_rows=1_000_000, compression="zstd", **kwargs):
+        columnar.require_pyarrow()
+        super().__init__(**kwargs)
+        self.directory = directory
+        self.max_rows = max_rows
+        self.compression = compression
+        self.started = time.strftime("%Y_%m_%d_%H_%M_%S")
+        self.writers = {}  # chat_name -> [ParquetWriter, rows written]
+        self.parts = {}
+
+    def _writer(self, chat_name):
+        state = self.writers.get(chat_name)
+        if state is None:
+            part = self.parts.get(chat_name, 0) + 1
+            self.parts[chat_name] = part
+            filename = os.path.join(self.directory, f'{chat_name}__{self.started}_{part:04d}.parquet')
+            state = self.writers[chat_name] = [columnar.pq.ParquetWriter(filename, columnar.schema(),
+                                                                         compression=self.compression), 0]
+        return state
+
+    def write_batch(self, pages):
+        documents = {}
+        for chat_name, messages in pages:
+            documents.setdefault(chat_name, []).extend(serialize(message) for message in messages)
+        for chat_name, rows in documents.items():
+            state = self._writer(chat_name)
+            state[0].write_table(columnar.to_table(rows))
+            state[1] += len(rows)
+            if state[1] >= self.max_rows:
+                self.writers.pop(chat_name)[0].close()
+
+    def finish(self):
+        for writer, _ in self.writers.values():
+            writer.close()
+        self.writers = {}
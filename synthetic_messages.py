@@ -0,0 +1,45 @@
+import random
+from datetime import datetime, timedelta, timezone
+from telethon.tl.types import (Message, MessageEntityBold, MessageEntityHashtag, MessageEntityUrl,
+                               MessageFwdHeader, MessageReplies, MessageReplyHeader, PeerChannel, PeerUser)
+
+# Mixed Arabic and Latin text, like the channels we crawl
+WORDS = ["عاجل", "غزة", "القدس", "فلسطين", "خبر", "مباشر", "breaking", "news", "update",
+         "https://t.me/pal_Online9", "#عاجل", "video", "صور", "الآن"]
+
+START_DATE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def make_message(message_id, channel_id=1, rng=random):
+    """Build a realistic Telethon Message for channel `channel_id`; newer ids have later dates."""
+    text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 60)))
+    date = START_DATE + timedelta(seconds=message_id * 97)
+    reply_to = None
+    if message_id > 1 and rng.random() < 0.2:
+        reply_to = MessageReplyHeader(reply_to_msg_id=rng.randint(1, message_id - 1))
+    fwd_from = None
+    if rng.random() < 0.1:
+        fwd_from = MessageFwdHeader(date=date - timedelta(hours=1), from_id=PeerChannel(channel_id + 1000),
+                                    channel_post=rng.randint(1, 10 ** 6))
+    return Message(
+        id=message_id,
+        peer_id=PeerChannel(channel_id),
+        date=date,
+        message=text,
+        post=True,
+        from_id=PeerUser(rng.randint(1, 500)) if rng.random() < 0.7 else None,
+        fwd_from=fwd_from,
+        reply_to=reply_to,
+        entities=[MessageEntityBold(offset=0, length=5), MessageEntityHashtag(offset=6, length=5),
+                  MessageEntityUrl(offset=12, length=24)],
+        views=rng.randint(100, 50000),
+        forwards=rng.randint(0, 500),
+        replies=MessageReplies(replies=rng.randint(0, 50), replies_pts=message_id),
+        edit_date=date + timedelta(minutes=5) if rng.random() < 0.05 else None,
+        post_author="editor" if rng.random() < 0.3 else None,
+    )
+
+
+def make_page(top_id, count, channel_id=1, rng=random):
+    """A page of `count` messages below and including `top_id`, newest first like get_messages."""
+    return [make_message(message_id, channel_id, rng) for message_id in range(top_id, max(0, top_id - count), -1)]
@@ -0,0 +1,27 @@
+import random
+import mongomock
+import pandas as pd
+from analytics import FIELDS, load_from_mongo
+from serializer import serialize
+from synthetic_messages import make_message
+
+
+def test_load_from_mongo_reads_a_mixed_schema_collection():
+    rng = random.Random(7)
+    messages = [make_message(message_id, rng=rng) for message_id in range(1, 61)]
+    collection = mongomock.MongoClient().db.messages
+    # Every third message as written with SERIALIZE_MODE="full", the rest lean
+    collection.insert_many([serialize(message, "full" if message.id % 3 == 0 else "lean") for message in messages])
+
+    frame = load_from_mongo(collection, chunk_rows=25).sort_values("id", ignore_index=True)
+    expected = load_from_mongo(_lean_collection(messages)).sort_values("id", ignore_index=True)
+
+    assert dict(frame.dtypes.astype(str)) == FIELDS
+    assert frame["fwd_from_id"].notna().any() and frame["reply_to_msg_id"].notna().any()
+    pd.testing.assert_frame_equal(frame, expected)
+
+
+def _lean_collection(messages):
+    collection = mongomock.MongoClient().db.messages
+    collection.insert_many([serialize(message, "lean") for message in messages])
+    return collection
@@ -0,0 +1,78 @@
+import asyncio
+import pytest
+import metrics
+from async_writer import ThreadedMessageWriter
+from mongo_writer import BulkMessageWriter
+
+
+class FailingCollection:
+    """Collection stand-in whose first `failures` bulk_writes raise."""
+
+    def __init__(self, failures=1):
+        self.failures = failures
+        self.writes = 0
+
+    def with_options(self, **options):
+        return self
+
+    def bulk_write(self, operations, ordered=False):
+        self.writes += 1
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("bulk_write failed")
+
+        class Result:
+            upserted_count = len(operations)
+            modified_count = 0
+            matched_count = 0
+            upserted_ids = {}
+        return Result()
+
+
+def page(message_id):
+    return [{"channel_id": 1, "id": message_id}]
+
+
+def test_failed_write_moves_no_checkpoint():
+    committed = []
+
+    async def run():
+        writer = ThreadedMessageWriter(BulkMessageWriter(FailingCollection()), verbose=False)
+        writer.start()
+        await writer.add(page(1))
+        writer.after_flush(lambda: committed.append(1))
+        await writer.add(page(2))
+        writer.after_flush(lambda: committed.append(2))
+        with pytest.raises(RuntimeError):
+            await writer.close()
+
+    asyncio.run(run())
+    assert committed == []
+
+
+def test_checkpoints_move_after_successful_writes():
+    committed = []
+
+    async def run():
+        writer = ThreadedMessageWriter(BulkMessageWriter(FailingCollection(failures=0)), verbose=False)
+        writer.start()
+        for message_id in (1, 2):
+            await writer.add(page(message_id))
+            writer.after_flush(lambda message_id=message_id: committed.append(message_id))
+        await writer.close()
+
+    asyncio.run(run())
+    assert committed == [1, 2]
+
+
+def test_writer_thread_metrics_keep_the_channel_label():
+    async def run():
+        metrics.channel.set("label_test_channel")
+        writer = ThreadedMessageWriter(BulkMessageWriter(FailingCollection(failures=0)), verbose=False)
+        writer.start()
+        await writer.add(page(1))
+        await writer.close()
+
+    asyncio.run(run())
+    labels = [dict(key) for key in metrics.WRITE_SECONDS.values]
+    assert {"channel": "label_test_channel", "sink": "mongo"} in labels
@@ -0,0 +1,22 @@
+import rate_limiter
+from rate_limiter import TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_set_rate_during_a_pause_earns_no_tokens(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock)
+    bucket = TokenBucket(10)
+    bucket.pause(5)
+    clock.now += 2
+    bucket.set_rate(10)  # A success of another in-flight request
+    clock.now += 3.05
+    bucket._refill()
+    assert bucket.tokens < 1
@@ -0,0 +1,20 @@
+import random
+from datetime import timedelta
+import mongomock
+from reconcile import changed_fields
+from serializer import serialize
+from synthetic_messages import make_message
+
+
+def test_edit_of_a_full_schema_message_only_reports_real_changes():
+    rng = random.Random(3)
+    message = next(message for message in (make_message(message_id, rng=rng) for message_id in range(1, 500))
+                   if message.fwd_from and message.edit_date)
+    collection = mongomock.MongoClient().db.messages
+    collection.insert_one(serialize(message, "full"))
+    # Stored before the edit: every field is compared, including the nested fwd_from.date
+    collection.update_one({}, {"$set": {"edit_date": message.edit_date - timedelta(minutes=1)}})
+    stored = collection.find_one({}, {"_id": 0})
+
+    assert stored["fwd_from"]["date"].tzinfo is None
+    assert set(changed_fields(serialize(message, "full"), stored)) == {"edit_date"}
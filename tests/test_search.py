@@ -0,0 +1,9 @@
+from search import SearchIndex
+
+
+def test_message_edited_to_empty_text_leaves_the_index():
+    index = SearchIndex(":memory:")
+    index.record([{"channel_id": 1, "id": 1, "text": "breaking news"}, {"channel_id": 1, "id": 2, "text": "news"}])
+    index.record([{"channel_id": 1, "id": 1, "text": ""}, {"channel_id": 1, "id": 2, "message": None}])
+    assert index.search("news") == []
+    index.close()
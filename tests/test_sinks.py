@@ -0,0 +1,34 @@
+import asyncio
+from sinks import Sink
+
+
+class AppendSink(Sink):
+    """Appending sink whose first write of channel "b" fails after channel "a" was appended."""
+
+    idempotent = False
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.lines = []
+        self.failed = False
+
+    def write_batch(self, pages):
+        for chat_name, messages in pages:
+            if chat_name == "b" and not self.failed:
+                self.failed = True
+                raise OSError("disk hiccup")
+            self.lines.extend((chat_name, message) for message in messages)
+
+
+def test_retry_does_not_repeat_channels_already_written():
+    async def run():
+        sink = AppendSink(batch_pages=4, retry_delay=0)
+        for chat_name, messages in (("a", [1, 2]), ("b", [3]), ("a", [4])):
+            await sink.submit(chat_name, messages)
+        sink.start()
+        await sink.close()
+        return sink
+
+    sink = asyncio.run(run())
+    assert sink.error is None
+    assert sorted(sink.lines) == [("a", 1), ("a", 2), ("a", 4), ("b", 3)]